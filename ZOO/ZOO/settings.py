@@ -31,6 +31,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'corsheaders',
     'rest_framework',
@@ -56,16 +57,40 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-    )
+        'main.renderers.FastJSONRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'main.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(hours=24),
 }
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_TIMEOUT = 10
+NOTIFICATIONS_BATCH_SIZE = 20
+NOTIFICATIONS_MAX_ATTEMPTS = 8
+NOTIFICATIONS_RETRY_DELAY = 30
+# Уведомление, взятое в отправку раньше (сек.), считается брошенным упавшим воркером
+NOTIFICATIONS_SENDING_TIMEOUT = 300
+RENDITION_BATCH_SIZE = 20
+# Задача, взятая в работу раньше (сек.), считается брошенной упавшим воркером
+RENDITION_CLAIM_TIMEOUT = 600
+RENDITION_WORKERS = int(os.getenv('RENDITION_WORKERS', os.cpu_count() or 1))
 REDIS_HOST = os.getenv('R_HOST')
 REDIS_PORT = os.getenv('R_PORT')
 REDIS_DB = os.getenv('R_DB')
+RECOMMEND_MAX_RELATED = 100
+RECOMMEND_ASYNC = os.getenv('RECOMMEND_ASYNC') == '1'
+SEARCH_CONFIG = 'russian'
+SUGGEST_LIMIT = 10
+FACETS_PRICE_BOUNDS = (500, 1000, 2000, 5000)
+CATALOG_INDEX_ENABLED = os.getenv('CATALOG_INDEX_ENABLED') == '1'
+ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ESTIMATED_COUNT_THRESHOLD', 10000))
+API_ESTIMATED_COUNT = os.getenv('API_ESTIMATED_COUNT') == '1'
 MIDDLEWARE = [
     # 'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -171,6 +196,11 @@ CACHES = {
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
 CACHE_TTL = 60 * 1
+CACHE_VERSIONED_TTL = 60 * 60 * 6
+CACHE_STALE_TTL = 60 * 60
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_WAIT = 5
+PRODUCTS_COUNT_TTL = 30
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -204,6 +234,9 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 3000
 MEDIA_URL = '/django_media/'
 
 MEDIA_ROOT = BASE_DIR / 'mediafiles'
+IMAGE_RENDITION_WIDTHS = (320, 640, 1024)
+IMAGE_RENDITION_QUALITY = 75
+IMAGE_RENDITION_MANIFEST = MEDIA_ROOT / '.renditions_manifest'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -0,0 +1,46 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .listing import refresh_product_listing
+from .models import Product, ProductOptions
+
+
+def update_products_activity(product_ids):
+    """Product.is_active = есть ли у товара активная фасовка, одним UPDATE"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    Product.objects.filter(pk__in=product_ids).update(
+        is_active=Exists(
+            ProductOptions.objects.filter(product=OuterRef("pk"), is_active=True)
+        )
+    )
+    refresh_product_listing(product_ids)
+
+
+_touched = threading.local()
+
+
+def _touched_product_ids():
+    if not hasattr(_touched, "product_ids"):
+        _touched.product_ids = set()
+    return _touched.product_ids
+
+
+def _update_touched_products():
+    product_ids = set(_touched_product_ids())
+    _touched.product_ids = set()
+    update_products_activity(product_ids)
+
+
+def touch_products(product_ids):
+    """
+    Откладывает пересчёт активности товаров до коммита транзакции, чтобы
+    сохранение любого числа фасовок давало один UPDATE на все их товары:
+    первый из колбэков коммита забирает все накопленные товары, остальные
+    ничего не делают. Вне транзакции пересчёт выполняется сразу.
+    """
+    _touched_product_ids().update(product_ids)
+    transaction.on_commit(_update_touched_products)
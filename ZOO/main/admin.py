@@ -1,10 +1,17 @@
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal, InvalidOperation
+
 from django import forms
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.admin.widgets import FilteredSelectMultiple
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Count, Max, Min
 from django.forms import ModelForm, TextInput
 from django.shortcuts import render
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from import_export.admin import ImportMixin
 
@@ -32,6 +39,13 @@ from .models import (
     SubCategory,
     Units,
 )
+from .discounts import assign_discount, options_by_rule, refresh_listing_for_discounts
+from .listing import (
+    refresh_listing_for_options,
+    refresh_listing_for_subcategories,
+    refresh_product_listing,
+)
+from .paginators import EstimatedCountPaginator
 from .resources import ProductOptionsResource
 
 
@@ -40,6 +54,110 @@ admin.site.site_title = "Территория ZOO"
 admin.site.index_title = ""
 
 
+def range_edges(low, high, buckets):
+    """Круглые (1, 2, 5 x 10^n) границы примерно buckets диапазонов между low и high"""
+    if low is None or high is None or low >= high:
+        return []
+    step = (high - low) / buckets
+    magnitude = Decimal(10) ** step.log10().to_integral_value(ROUND_FLOOR)
+    step = next(magnitude * factor for factor in (1, 2, 5, 10) if magnitude * factor >= step)
+    edge = (low / step).to_integral_value(ROUND_FLOOR) * step + step
+    last = (high / step).to_integral_value(ROUND_CEILING) * step
+    edges = []
+    while edge < last:
+        edges.append(edge)
+        edge += step
+    return edges
+
+
+def format_edge(edge):
+    return f"{edge.normalize():f}"
+
+
+class RangeListFilter(admin.SimpleListFilter):
+    """
+    Фильтр по диапазонам числового поля вместо списка всех его значений.
+    Минимум и максимум полей всех таких фильтров страницы считаются одним
+    агрегатом на запрос.
+    """
+
+    field_name = None
+    buckets = 6
+
+    @classmethod
+    def for_field(cls, field_name, title):
+        return type(
+            f"{field_name.title()}RangeFilter",
+            (cls,),
+            {"field_name": field_name, "title": title, "parameter_name": f"{field_name}_range"},
+        )
+
+    def lookups(self, request, model_admin):
+        bounds = getattr(request, "range_filter_bounds", None)
+        if bounds is None:
+            aggregates = {}
+            for list_filter in model_admin.get_list_filter(request):
+                if isinstance(list_filter, type) and issubclass(list_filter, RangeListFilter):
+                    aggregates[f"{list_filter.field_name}__min"] = Min(list_filter.field_name)
+                    aggregates[f"{list_filter.field_name}__max"] = Max(list_filter.field_name)
+            bounds = request.range_filter_bounds = model_admin.get_queryset(request).order_by().aggregate(
+                **aggregates
+            )
+        edges = [format_edge(edge) for edge in range_edges(
+            bounds[f"{self.field_name}__min"], bounds[f"{self.field_name}__max"], self.buckets
+        )]
+        if not edges:
+            return []
+        lookups = [(f"..{edges[0]}", f"до {edges[0]}")]
+        lookups += [(f"{low}..{high}", f"{low} – {high}") for low, high in zip(edges, edges[1:])]
+        lookups.append((f"{edges[-1]}..", f"от {edges[-1]}"))
+        return lookups
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        low, separator, high = self.value().partition("..")
+        if not separator:
+            raise IncorrectLookupParameters(self.value())
+        filters = {}
+        try:
+            if low:
+                filters[f"{self.field_name}__gte"] = Decimal(low)
+            if high:
+                filters[f"{self.field_name}__lt"] = Decimal(high)
+        except InvalidOperation:
+            raise IncorrectLookupParameters(self.value())
+        return queryset.filter(**filters)
+
+
+class ProductCategoryListFilter(admin.SimpleListFilter):
+    """Категория товара по массиву category_ids (GIN-индекс), без соединения со связью M2M"""
+
+    title = "Категория товара"
+    parameter_name = "category"
+
+    def lookups(self, request, model_admin):
+        return [(category.pk, str(category)) for category in Category.objects.select_related("animal")]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            category_id = int(self.value())
+        except ValueError:
+            raise IncorrectLookupParameters(self.value())
+        return queryset.filter(product__category_ids__contains=[category_id])
+
+
+class AssignDiscountForm(forms.Form):
+    discount = forms.ModelChoiceField(
+        label="Скидка",
+        queryset=DiscountByProductOption.objects.all(),
+        required=False,
+        empty_label="--- снять скидку ---",
+    )
+
+
 class ProductImageInline(admin.TabularInline):
     """Изображение товара"""
     model = ProductImage
@@ -73,9 +191,12 @@ class ProductOptionsAdmin(ImportMixin, admin.ModelAdmin):
         "is_active",
         "partial",
         "units",
-        "price",
-        "size",
-        "stock_balance",
+        "discount_by_product_option",
+        "product__brand",
+        ProductCategoryListFilter,
+        RangeListFilter.for_field("price", "Цена"),
+        RangeListFilter.for_field("size", "Объём упаковки"),
+        RangeListFilter.for_field("stock_balance", "Остаток на складе"),
     )
     search_fields = (
         "article_number",
@@ -92,6 +213,73 @@ class ProductOptionsAdmin(ImportMixin, admin.ModelAdmin):
         "discount_by_product_option",
     )
     autocomplete_fields = ["product", "units", "discount_by_product_option"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ("assign_discount_action",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related("product__animal")
+
+    @admin.action(description="Назначить скидку выбранным вариантам")
+    def assign_discount_action(self, request, queryset):
+        """
+        Промежуточная страница: выбор скидки, затем предпросмотр числа
+        вариантов, у которых она изменится, и применение одним UPDATE ко
+        всей выборке, включая «выбрать все» по текущим фильтрам.
+        """
+        form = AssignDiscountForm(
+            request.POST if "preview" in request.POST or "apply" in request.POST else None
+        )
+        changed = None
+        if form.is_bound and form.is_valid():
+            if "apply" in request.POST:
+                updated = assign_discount(queryset, form.cleaned_data["discount"])
+                self.message_user(request, f"Скидка изменена у вариантов: {updated}")
+                return None
+            # Считается так же, как выборка assign_discount
+            changed = queryset.exclude(discount_by_product_option=form.cleaned_data["discount"]).count()
+            form.fields["discount"].widget = forms.HiddenInput()
+        current_discounts = list(
+            queryset.order_by("discount_by_product_option__title")
+            .values("discount_by_product_option__title", "discount_by_product_option__discount_amount")
+            .annotate(count=Count("id"))
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Назначение скидки вариантам товаров",
+            "opts": self.model._meta,
+            "form": form,
+            "count": sum(row["count"] for row in current_discounts),
+            "changed": changed,
+            "current_discounts": current_discounts,
+            "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+            "selected": request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            "select_across": request.POST.get("select_across", "0"),
+            "action": request.POST.get("action"),
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, "admin/assign_discount.html", context)
+
+    def get_changelist_formset(self, request, **kwargs):
+        formset_class = super().get_changelist_formset(request, **kwargs)
+        # Единицы измерения для всех строк списка загружаются одним запросом,
+        # а не виджетом автодополнения в каждой строке
+        units = [("", "---------"), *((unit.pk, str(unit)) for unit in Units.objects.all())]
+
+        class ChangeListFormSet(formset_class):
+            def _construct_form(self, i, **kwargs):
+                form = super()._construct_form(i, **kwargs)
+                form.fields["units"].widget = forms.Select()
+                form.fields["units"].choices = units
+                return form
+
+        return ChangeListFormSet
+
+    def changelist_view(self, request, extra_context=None):
+        # Правки list_editable сохраняются одной транзакцией, чтобы активность
+        # товаров пересчитывалась один раз при коммите, а не на каждую строку
+        with transaction.atomic():
+            return super().changelist_view(request, extra_context)
 
 
 class ProductOptionsInline(admin.TabularInline):
@@ -165,6 +353,8 @@ class ProductAdmin(admin.ModelAdmin):
     # resource_class = ProductAdminResource
     # change_list_template = "admin/model_change_list_product.html"
     list_per_page = 20
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     autocomplete_fields = [
         "animal",
     ]
@@ -181,6 +371,11 @@ class ProductAdmin(admin.ModelAdmin):
         obj.__dict__["animal_ids"] = animal_ids
         obj.save()
 
+    def save_related(self, request, form, formsets, change):
+        # Витрина пересчитывается после сохранения подкатегорий и фасовок
+        super().save_related(request, form, formsets, change)
+        refresh_product_listing((form.instance.id,))
+
 
 class CategoryInline(admin.TabularInline):
     model = Category
@@ -464,6 +659,8 @@ class CustomerAdmin(admin.ModelAdmin):
         "phone_number",
     )
     list_per_page = 20
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [OrderInlineAdmin]
 
 
@@ -494,6 +691,9 @@ class OrderAdmin(admin.ModelAdmin):
         "created",
     )
     list_per_page = 20
+    list_select_related = ("customer",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [OrderItemInlineAdmin]
 
 
@@ -530,6 +730,22 @@ class DiscountBySubCategoryAdmin(admin.ModelAdmin):
     )
     autocomplete_fields = ("subcategory",)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        subcategories = {obj.subcategory_id}
+        if form.initial.get("subcategory") is not None:
+            subcategories.add(form.initial["subcategory"])
+        refresh_listing_for_subcategories(subcategories)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_listing_for_subcategories((obj.subcategory_id,))
+
+    def delete_queryset(self, request, queryset):
+        subcategories = list(queryset.values_list("subcategory_id", flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_listing_for_subcategories(subcategories)
+
 
 class ProductOptionsInlineForDiscount(admin.TabularInline):
     """Опции продукта"""
@@ -540,42 +756,133 @@ class ProductOptionsInlineForDiscount(admin.TabularInline):
     extra = 1
 
 
-class DiscountByProductOptionsForm(forms.ModelForm):
-    options = forms.ModelMultipleChoiceField(
-        label="Вариант Товара",
-        queryset=ProductOptions.objects.all(),
-        widget=FilteredSelectMultiple(verbose_name="Варианты Товара", is_stacked=False),
+class DiscountRuleMixin(forms.Form):
+    """Правило отбора вариантов товаров для назначения скидки"""
+
+    brands = forms.ModelMultipleChoiceField(
+        label="Бренды",
+        queryset=Brand.objects.all(),
+        required=False,
+        widget=FilteredSelectMultiple(verbose_name="Бренды", is_stacked=False),
+    )
+    categories = forms.ModelMultipleChoiceField(
+        label="Категории",
+        queryset=Category.objects.select_related("animal"),
+        required=False,
+        widget=FilteredSelectMultiple(verbose_name="Категории", is_stacked=False),
+    )
+    subcategories = forms.ModelMultipleChoiceField(
+        label="Подкатегории",
+        queryset=SubCategory.objects.select_related("category__animal"),
+        required=False,
+        widget=FilteredSelectMultiple(verbose_name="Подкатегории", is_stacked=False),
+    )
+    article_prefix = forms.CharField(label="Артикул начинается с", max_length=50, required=False)
+
+    RULE_FIELDS = ("brands", "categories", "subcategories", "article_prefix")
+
+    def has_rule(self):
+        return any(self.cleaned_data.get(field) for field in self.RULE_FIELDS)
+
+    def rule_options(self, **kwargs):
+        return options_by_rule(**{field: self.cleaned_data.get(field) for field in self.RULE_FIELDS}, **kwargs)
+
+
+class DiscountByProductOptionsForm(DiscountRuleMixin, forms.ModelForm):
+    """
+    Скидка и правило назначения: варианты отбираются запросом по правилу,
+    а не выбором из списка всех вариантов. Перед изменением вариантов форма
+    показывает их число и ждёт повторного сохранения.
+    """
+
+    ASSIGN = "assign"
+    REMOVE = "remove"
+
+    assignment = forms.ChoiceField(
+        label="Действие",
+        choices=(
+            (ASSIGN, "Назначить скидку вариантам по правилу"),
+            (REMOVE, "Снять скидку с вариантов по правилу"),
+        ),
+        initial=ASSIGN,
+        required=False,
     )
+    only_free = forms.BooleanField(
+        label="Только варианты без другой скидки", initial=True, required=False
+    )
+    confirmed_count = forms.IntegerField(widget=forms.HiddenInput, required=False)
 
     class Meta:
         model = DiscountByProductOption
         fields = "__all__"
 
-    def __init__(self, *args, **kwargs):
-        super(DiscountByProductOptionsForm, self).__init__(*args, **kwargs)
-        if self.instance.pk:
-            self.fields["options"].queryset = ProductOptions.objects.select_related(
-                "units", "product"
-            ).filter(
-                (
-                    Q(discount_by_product_option_id=None)
-                    | Q(discount_by_product_option_id=self.instance.pk)
-                )
-            )
-            self.fields["options"].initial = self.instance.options.all()
-        else:
-            self.fields["options"].queryset = self.fields["options"].queryset.filter(
-                discount_by_product_option_id=None
+    def affected_options(self):
+        """Варианты, у которых сохранение формы изменит скидку"""
+        discount = self.instance if self.instance.pk else None
+        if self.cleaned_data.get("assignment") == self.REMOVE:
+            if discount is None:
+                return ProductOptions.objects.none()
+            return self.rule_options().filter(discount_by_product_option=discount)
+        options = self.rule_options(only_free=self.cleaned_data.get("only_free"), discount=discount)
+        if discount is not None:
+            options = options.exclude(discount_by_product_option=discount)
+        return options
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.errors or not self.has_rule():
+            return cleaned_data
+        count = self.affected_options().count()
+        if cleaned_data.get("confirmed_count") != count:
+            # Число показывается в форме; повторное сохранение с тем же
+            # числом подтверждает изменение
+            self.data = self.data.copy()
+            self.data[self.add_prefix("confirmed_count")] = count
+            raise forms.ValidationError(
+                f"Правило изменит скидку у вариантов: {count}. "
+                "Проверьте правило и сохраните ещё раз для подтверждения."
             )
+        return cleaned_data
+
+    def apply_rule(self, discount):
+        if not self.has_rule():
+            return 0
+        if self.cleaned_data.get("assignment") == self.REMOVE:
+            return assign_discount(self.affected_options(), None)
+        return assign_discount(self.affected_options(), discount)
+
 
 @admin.register(DiscountByProductOption)
 class DiscountByProductOptionAdmin(admin.ModelAdmin):
     form = DiscountByProductOptionsForm
-    # fields = 'title', 'discount_amount', 'is_active',
+    fieldsets = (
+        (None, {"fields": ("title", "discount_amount", "is_active", "options_link")}),
+        (
+            "Назначение по правилу",
+            {
+                "fields": (
+                    "assignment",
+                    "brands",
+                    "categories",
+                    "subcategories",
+                    "article_prefix",
+                    "only_free",
+                    "confirmed_count",
+                ),
+                "description": (
+                    "Условия объединяются через И, значения внутри условия - через ИЛИ. "
+                    "Отдельные варианты удобнее отбирать в списке вариантов товаров "
+                    "действием «Назначить скидку»."
+                ),
+            },
+        ),
+    )
+    readonly_fields = ("options_link",)
     list_display = (
         "title",
         "discount_amount",
         "is_active",
+        "options_link",
     )
     list_editable = (
         "is_active",
@@ -585,24 +892,48 @@ class DiscountByProductOptionAdmin(admin.ModelAdmin):
         "is_active",
         "discount_amount",
     )
-    search_fields = ("title", "discount_amount", "options")
+    search_fields = ("title", "discount_amount", "options__article_number")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(options_count=Count("options", distinct=True))
+
+    @admin.display(description="Варианты со скидкой")
+    def options_link(self, obj):
+        if obj is None or obj.pk is None:
+            return "-"
+        count = getattr(obj, "options_count", None)
+        if count is None:
+            count = obj.options.count()
+        url = reverse("admin:main_productoptions_changelist")
+        return format_html(
+            '<a href="{}?discount_by_product_option__id__exact={}">{}</a>', url, obj.pk, count
+        )
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        original_options = set(obj.options.values_list("id", flat=True))
-        if form.cleaned_data.get("options") is not None:
-            current_options = set(map(lambda x: x.id, form.cleaned_data.get("options")))
-        else:
-            current_options = set()
-        if original_options != current_options:
-            add_to_discount = current_options - original_options
-            ProductOptions.objects.filter(id__in=add_to_discount).update(
-                discount_by_product_option_id=obj.id
-            )
-            remove_from_discount = original_options - current_options
-            ProductOptions.objects.filter(id__in=remove_from_discount).update(
-                discount_by_product_option_id=None
-            )
+        # В форме списка (list_editable) нет полей правила: варианты не
+        # трогаются, витрина пересчитывается только при смене процента
+        # или активности
+        if change and {"discount_amount", "is_active"} & set(form.changed_data):
+            refresh_listing_for_discounts((obj,))
+        if isinstance(form, DiscountByProductOptionsForm):
+            updated = form.apply_rule(obj)
+            if updated:
+                self.message_user(request, f"Скидка изменена у вариантов: {updated}")
+
+    def delete_model(self, request, obj):
+        options = list(obj.options.values_list("id", flat=True))
+        super().delete_model(request, obj)
+        refresh_listing_for_options(options)
+
+    def delete_queryset(self, request, queryset):
+        options = list(
+            ProductOptions.objects.filter(
+                discount_by_product_option__in=queryset
+            ).values_list("id", flat=True)
+        )
+        super().delete_queryset(request, queryset)
+        refresh_listing_for_options(options)
 
 
 class DiscountByDayOptionsAdminInline(admin.TabularInline):
@@ -1,7 +1,23 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
+
+
+def create_extensions(using, **kwargs):
+    """pg_trgm нужен индексу по названию товара раньше, чем создаются таблицы"""
+    from django.db import connections
+
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
-    verbose_name = "Территория ZOO"
\ No newline at end of file
+    verbose_name = "Территория ZOO"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        pre_migrate.connect(create_extensions, sender=self)
@@ -0,0 +1,197 @@
+import datetime
+import time
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from rest_framework.response import Response
+
+VERSION_KEY = "RESOURCE_VERSION:{}"
+LAST_MODIFIED_KEY = "LAST_MODIFIED:{}"
+STATS_KEY = "CACHE_STATS:{}:{}"
+STATS_COUNTERS = ("hit", "miss", "stale", "lock_wait")
+LOCK_POLL_INTERVAL = 0.05
+
+cached_prefixes = []
+
+
+def _initial_version():
+    # Счётчик мог быть вытеснен из Redis: начинаем с метки времени,
+    # чтобы не совпасть с версиями уже закешированных ответов.
+    return int(time.time() * 1000)
+
+
+def get_versions(resources):
+    keys = [VERSION_KEY.format(resource) for resource in resources]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(*resources):
+    for resource in resources:
+        key = VERSION_KEY.format(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), timeout=None)
+
+
+def bump_version_on_commit(*resources):
+    """
+    Меняет версии после коммита текущей транзакции (вне транзакции - сразу):
+    иначе параллельный запрос может закешировать старые строки под новой
+    версией
+    """
+    transaction.on_commit(lambda: bump_version(*resources))
+
+
+def count(key_prefix, counter):
+    key = STATS_KEY.format(key_prefix, counter)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def get_cache_stats():
+    keys = {
+        STATS_KEY.format(prefix, counter): (prefix, counter)
+        for prefix in cached_prefixes
+        for counter in STATS_COUNTERS
+    }
+    values = cache.get_many(list(keys))
+    stats = {prefix: dict.fromkeys(STATS_COUNTERS, 0) for prefix in cached_prefixes}
+    for key, (prefix, counter) in keys.items():
+        stats[prefix][counter] = values.get(key, 0)
+    return stats
+
+
+def reset_cache_stats():
+    cache.delete_many(
+        [
+            STATS_KEY.format(prefix, counter)
+            for prefix in cached_prefixes
+            for counter in STATS_COUNTERS
+        ]
+    )
+
+
+def _is_fresh(entry, versions):
+    return entry["versions"] == versions and entry["fresh_until"] > time.time()
+
+
+def versioned_cache_page(resources, key_prefix, timeout=None):
+    """
+    Кеширует ответ списка до изменения любого из ресурсов resources.
+
+    Устаревший ответ (сменилась версия ресурса или истёк timeout) ещё
+    CACHE_STALE_TTL секунд отдаётся остальным воркерам, пока один из них,
+    взявший блокировку, пересчитывает ответ.
+    """
+    timeout = settings.CACHE_VERSIONED_TTL if timeout is None else timeout
+    cached_prefixes.append(key_prefix)
+
+    def decorator(view_func):
+        def render(request, key, versions, *args, **kwargs):
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200:
+                entry = {
+                    "versions": versions,
+                    "fresh_until": time.time() + timeout,
+                    "data": response.data,
+                    "status": response.status_code,
+                }
+                cache.set(key, entry, timeout + settings.CACHE_STALE_TTL)
+            return response
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+            versions = get_versions(resources)
+            key = f"{key_prefix}:{md5(request.get_full_path().encode()).hexdigest()}"
+            entry = cache.get(key)
+            if entry is not None and _is_fresh(entry, versions):
+                count(key_prefix, "hit")
+                return Response(entry["data"], status=entry["status"])
+
+            lock_key = f"{key}:lock"
+            if cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+                count(key_prefix, "miss")
+                try:
+                    return render(request, key, versions, *args, **kwargs)
+                finally:
+                    cache.delete(lock_key)
+
+            if entry is not None:
+                count(key_prefix, "stale")
+                return Response(entry["data"], status=entry["status"])
+
+            count(key_prefix, "lock_wait")
+            deadline = time.time() + settings.CACHE_LOCK_WAIT
+            while time.time() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                entry = cache.get(key)
+                if entry is not None and entry["versions"] == versions:
+                    return Response(entry["data"], status=entry["status"])
+                if cache.get(lock_key) is None:
+                    break
+            return render(request, key, versions, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def versioned_condition(resources, models=(), daily=False):
+    """
+    Условный GET (ETag/Last-Modified) для ресурсов resources: повторный
+    запрос с тем же ETag получает 304 без выполнения view. ETag - версии
+    ресурсов в кеше, Last-Modified - максимальный date_updated моделей
+    models, он считается один раз на каждый набор версий.
+    daily - ответ зависит от текущего дня (скидки по дням недели).
+    """
+    labels = [model._meta.label for model in models]
+
+    def current_day():
+        return datetime.date.today() if daily else None
+
+    def etag(request, *args, **kwargs):
+        signature = (resources, get_versions(resources), current_day())
+        return md5(repr(signature).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        versions = get_versions(resources)
+        key = LAST_MODIFIED_KEY.format(md5(repr((labels, versions)).encode()).hexdigest())
+        dates = cache.get(key)
+        if dates is None:
+            dates = [model.objects.aggregate(last=Max("date_updated"))["last"] for model in models]
+            cache.set(key, dates, settings.CACHE_VERSIONED_TTL)
+        day = current_day()
+        if day is not None:
+            # Полночь по времени сервера, как в DiscountByDayViewSet
+            dates.append(datetime.datetime.combine(day, datetime.time()).astimezone())
+        return max(filter(None, dates), default=None)
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            # Браузер не использует ответ без проверки ETag на сервере
+            patch_cache_control(response, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,162 @@
+import threading
+from collections import defaultdict
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .cache import get_versions
+from .models import ProductListing
+
+ORDERING_FIELDS = ("name", "popular", "date_added", "min_price")
+INDEX_IGNORED_PARAMS = ("page", "page_size", "ordering")
+
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+class CatalogIndex:
+    """
+    Витрина каталога в памяти процесса: битовая маска товаров (int) на каждое
+    значение фильтра и позиции товаров, отсортированные по каждому полю
+    сортировки. Бит i соответствует товару self.ids[i].
+    """
+
+    def __init__(self, rows):
+        self.ids = []
+        self.bitmaps = {name: defaultdict(int) for name in ("animal", "brand", "category", "subcategory")}
+        self.on_discount = 0
+        sort_keys = {field: [] for field in ORDERING_FIELDS}
+        for position, row in enumerate(rows):
+            bit = 1 << position
+            self.ids.append(row["product_id"])
+            self.bitmaps["brand"][row["brand_id"]] |= bit
+            for name in ("animal", "category", "subcategory"):
+                for pk in row[f"{name}_ids"]:
+                    self.bitmaps[name][pk] |= bit
+            if row["greatest_discount"]:
+                self.on_discount |= bit
+            # Ранг имени посчитан в БД, чтобы порядок совпадал с её сортировкой
+            sort_keys["name"].append(row["name_rank"])
+            sort_keys["popular"].append(row["popular"])
+            sort_keys["date_added"].append(row["date_added"])
+            sort_keys["min_price"].append(row["min_price"])
+        self.everything = (1 << len(self.ids)) - 1
+        self.orders = {
+            field: sorted(range(len(self.ids)), key=lambda position: (keys[position], self.ids[position]))
+            for field, keys in sort_keys.items()
+        }
+
+    @classmethod
+    def build(cls):
+        rows = ProductListing.objects.annotate(
+            name_rank=Window(RowNumber(), order_by=(F("name").asc(), F("product_id").asc()))
+        ).values(
+            "product_id",
+            "name_rank",
+            "brand_id",
+            "popular",
+            "date_added",
+            "min_price",
+            "greatest_discount",
+            "animal_ids",
+            "category_ids",
+            "subcategory_ids",
+        )
+        return cls(rows)
+
+    def _any_of(self, name, values):
+        bits = 0
+        for value in values:
+            bits |= self.bitmaps[name].get(int(value), 0)
+        return bits
+
+    def select(self, query_params, default_ordering, queryset):
+        """
+        CatalogSelection для параметров списка товаров (товары страницы
+        загружаются из queryset) или None, если запрос нельзя ответить из
+        индекса (поиск, курсорная пагинация, составная сортировка,
+        некорректные значения) и его нужно выполнить в БД.
+        """
+        supported = ("animal", "brand", "category", "subcategory", "on_discount", *INDEX_IGNORED_PARAMS)
+        if any(key not in supported for key in query_params):
+            return None
+        ordering = [order.strip() for order in query_params.get("ordering", "").split(",") if order.strip()]
+        ordering = [order for order in ordering if order.lstrip("-") in ORDERING_FIELDS] or list(default_ordering)
+        if len(ordering) != 1:
+            return None
+        bits = self.everything
+        try:
+            animal = query_params.get("animal")
+            if animal:
+                bits &= self._any_of("animal", (animal,))
+            brands = query_params.getlist("brand")
+            if brands:
+                bits &= self._any_of("brand", brands[0].split(","))
+            category = query_params.get("category")
+            if category:
+                bits &= self._any_of("category", (category,))
+            subcategory = query_params.getlist("subcategory")
+            if subcategory:
+                bits &= self._any_of("subcategory", subcategory[0].split(","))
+        except ValueError:
+            return None
+        if query_params.get("on_discount"):
+            bits &= self.on_discount
+        field = ordering[0]
+        order = self.orders[field.lstrip("-")]
+        if field.startswith("-"):
+            order = order[::-1]
+        return CatalogSelection(self, bits, order, queryset)
+
+
+class CatalogSelection:
+    """
+    Отфильтрованный и отсортированный список товаров для пагинатора: длина
+    считается по маске, а из БД загружаются только товары среза-страницы.
+    """
+
+    def __init__(self, index, bits, order, queryset):
+        self.index = index
+        self.bits = bits
+        self.order = order
+        self.queryset = queryset
+        self.count = popcount(bits)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, page):
+        start, stop, _ = page.indices(self.count)
+        ids = []
+        skip = start
+        for position in self.order:
+            if len(ids) == stop - start:
+                break
+            if self.bits >> position & 1:
+                if skip:
+                    skip -= 1
+                else:
+                    ids.append(self.index.ids[position])
+        products = {product.pk: product for product in self.queryset.filter(pk__in=ids)}
+        return [products[pk] for pk in ids if pk in products]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_catalog_index():
+    """
+    Индекс процесса; пересобирается, когда меняется версия catalog_index в
+    кеше - при изменении полей витрины, по которым он строится
+    """
+    global _index, _index_version
+    version = get_versions(("catalog_index",))[0]
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = CatalogIndex.build()
+                _index_version = version
+    return _index
@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .listing import refresh_product_listing
+from .models import ProductOptions
+
+
+def options_by_rule(brands=(), categories=(), subcategories=(), article_prefix="", only_free=False, discount=None):
+    """
+    Варианты товаров под правило назначения скидки: бренд, категория,
+    подкатегория (любой из выбранных) и начало артикула. Пустое условие
+    не ограничивает выборку. only_free - только варианты без другой скидки.
+    """
+    options = ProductOptions.objects.all()
+    if brands:
+        options = options.filter(product__brand__in=brands)
+    if categories:
+        options = options.filter(product__category_ids__overlap=[category.pk for category in categories])
+    if subcategories:
+        options = options.filter(
+            product__subcategory_ids__overlap=[subcategory.pk for subcategory in subcategories]
+        )
+    if article_prefix:
+        options = options.filter(article_number__startswith=article_prefix)
+    if only_free:
+        free = Q(discount_by_product_option=None)
+        if discount is not None and discount.pk:
+            free |= Q(discount_by_product_option=discount)
+        options = options.filter(free)
+    return options
+
+
+def assign_discount(options, discount):
+    """
+    Назначает скидку (или снимает при discount=None) вариантам queryset
+    options одним UPDATE и пересчитывает витрину их товаров.
+    Возвращает число изменённых вариантов.
+    """
+    options = options.exclude(discount_by_product_option=discount)
+    with transaction.atomic():
+        product_ids = set(options.values_list("product_id", flat=True).distinct())
+        updated = ProductOptions.objects.filter(pk__in=options.values("pk")).update(
+            discount_by_product_option=discount
+        )
+        refresh_product_listing(product_ids)
+    return updated
+
+
+def refresh_listing_for_discounts(discounts):
+    """Пересчитывает витрину товаров, у вариантов которых одна из скидок discounts"""
+    product_ids = set(
+        ProductOptions.objects.filter(discount_by_product_option__in=discounts)
+        .values_list("product_id", flat=True)
+        .distinct()
+    )
+    return refresh_product_listing(product_ids)
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import connection
+
+FACETS_SQL = """
+WITH filtered AS (
+    SELECT brand_id, animal_ids, category_ids, subcategory_ids, greatest_discount, min_price
+    FROM main_productlisting
+    WHERE product_id IN ({products})
+)
+SELECT 'brands', b.id, b.name, 0, COUNT(*)
+FROM filtered f JOIN main_brand b ON b.id = f.brand_id
+GROUP BY b.id, b.name
+UNION ALL
+SELECT 'animals', a.id, a.name, a.num_ordering, COUNT(*)
+FROM filtered f CROSS JOIN LATERAL unnest(f.animal_ids) AS ids(id) JOIN main_animal a ON a.id = ids.id
+GROUP BY a.id, a.name, a.num_ordering
+UNION ALL
+SELECT 'categories', c.id, c.name, c.num_ordering, COUNT(*)
+FROM filtered f CROSS JOIN LATERAL unnest(f.category_ids) AS ids(id) JOIN main_category c ON c.id = ids.id
+WHERE c.is_active
+GROUP BY c.id, c.name, c.num_ordering
+UNION ALL
+SELECT 'subcategories', s.id, s.name, s.num_ordering, COUNT(*)
+FROM filtered f CROSS JOIN LATERAL unnest(f.subcategory_ids) AS ids(id) JOIN main_subcategory s ON s.id = ids.id
+WHERE s.is_active
+GROUP BY s.id, s.name, s.num_ordering
+UNION ALL
+SELECT 'price', width_bucket(f.min_price, %s::numeric[]), NULL, 0, COUNT(*)
+FROM filtered f
+GROUP BY 2
+UNION ALL
+SELECT 'total', NULL, NULL, 0, COUNT(*) FROM filtered
+UNION ALL
+SELECT 'on_discount', NULL, NULL, 0, COUNT(*) FROM filtered WHERE greatest_discount > 0
+ORDER BY 1, 4, 3, 2
+"""
+
+
+def catalog_facets(products):
+    """
+    Счётчики для боковой панели каталога одним запросом: бренды, животные,
+    категории, подкатегории, товары со скидкой и ценовые диапазоны
+    по витрине отфильтрованных товаров products.
+    """
+    products_sql, products_params = products.order_by().values("pk").query.sql_with_params()
+    bounds = list(settings.FACETS_PRICE_BOUNDS)
+    facets = {"total": 0, "on_discount": 0, "brands": [], "animals": [], "categories": [], "subcategories": []}
+    prices = dict.fromkeys(range(len(bounds) + 1), 0)
+    with connection.cursor() as cursor:
+        cursor.execute(FACETS_SQL.format(products=products_sql), (*products_params, bounds))
+        for facet, pk, name, _, count in cursor.fetchall():
+            if facet == "price":
+                prices[pk] = count
+            elif pk is None:
+                facets[facet] = count
+            else:
+                facets[facet].append({"id": pk, "name": name, "count": count})
+    edges = [None, *bounds, None]
+    facets["price"] = [
+        {"from": edges[bucket], "to": edges[bucket + 1], "count": count}
+        for bucket, count in prices.items()
+    ]
+    return facets
@@ -0,0 +1,230 @@
+import os
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from imagekit.processors import ResizeToFit, Transpose
+from PIL import Image, features
+from pilkit.utils import process_image
+
+from .activity import touch_products
+from .cache import bump_version
+from .models import Animal, Article, Banner, Brand, ProductImage, RenditionTask
+
+# Расширение файла, формат PIL и MIME-тип рендиций; WEBP - если Pillow
+# собран с libwebp
+RENDITION_FORMATS = tuple(
+    rendition_format
+    for rendition_format in (
+        ("webp", "WEBP", "image/webp"),
+        ("jpg", "JPEG", "image/jpeg"),
+    )
+    if rendition_format[1] != "WEBP" or features.check("webp")
+)
+# Каталоги загрузки полей, для которых создаются рендиции
+RENDITION_DIRECTORIES = (
+    "photos_products",
+    "photos_brand",
+    "photos_animal",
+    "photos_article",
+    "photos_banner",
+)
+RENDITION_RE = re.compile(r"_\d+w\.(webp|jpg)$")
+
+
+def rendition_name(name, width, extension):
+    """photos_brand/acana.jpg -> photos_brand/acana_320w.webp, рядом с оригиналом"""
+    root, _ = os.path.splitext(name)
+    return f"{root}_{width}w.{extension}"
+
+
+def rendition_names(name):
+    return [
+        rendition_name(name, width, extension)
+        for width in sorted(settings.IMAGE_RENDITION_WIDTHS, reverse=True)
+        for extension, _, _ in RENDITION_FORMATS
+    ]
+
+
+def has_renditions(image):
+    """
+    Готовы ли рендиции изображения: рендиция, которая создаётся последней,
+    служит отметкой готовности всего набора
+    """
+    return bool(image) and image.storage.exists(rendition_names(image.name)[-1])
+
+
+def generate_renditions(name, storage=None):
+    """
+    Создаёт (или пересоздаёт) все рендиции файла name; возвращает их число.
+    Изображение декодируется один раз, каждая следующая (меньшая) ширина
+    уменьшается из предыдущей.
+    """
+    storage = storage or default_storage
+    with storage.open(name) as source:
+        image = Transpose().process(Image.open(source))
+        image.load()
+    count = 0
+    for width in sorted(settings.IMAGE_RENDITION_WIDTHS, reverse=True):
+        image = ResizeToFit(width=width, upscale=False).process(image)
+        for extension, format, _ in RENDITION_FORMATS:
+            target = rendition_name(name, width, extension)
+            content = process_image(
+                image, format=format, options={"quality": settings.IMAGE_RENDITION_QUALITY}
+            )
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, File(content))
+            count += 1
+    return count
+
+
+def render_file(name):
+    """
+    Задача для пула процессов: (name, число рендиций, секунды, ошибка).
+    Ошибка чтения или декодирования не прерывает обработку остальных файлов.
+    """
+    started = time.monotonic()
+    try:
+        count = generate_renditions(name)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return name, 0, time.monotonic() - started, str(e)
+    return name, count, time.monotonic() - started, ""
+
+
+def iter_media_images(root=None):
+    """Имена (относительно MEDIA_ROOT) исходных изображений в каталогах загрузки"""
+    root = str(root or settings.MEDIA_ROOT)
+    for directory in RENDITION_DIRECTORIES:
+        for path, _, files in os.walk(os.path.join(root, directory)):
+            for filename in sorted(files):
+                if not RENDITION_RE.search(filename):
+                    yield os.path.relpath(os.path.join(path, filename), root).replace(os.sep, "/")
+
+
+class RenditionManifest:
+    """
+    Журнал обработанных файлов: строка "имя<TAB>размер<TAB>mtime" на файл.
+    Дописывается после каждого файла, поэтому прерванный обход продолжается
+    с места остановки; изменённый файл (другой размер или mtime)
+    обрабатывается заново.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as manifest:
+                for line in manifest:
+                    name, _, stamp = line.rstrip("\n").partition("\t")
+                    self.done[name] = stamp
+
+    @staticmethod
+    def stamp(name):
+        stat = os.stat(os.path.join(settings.MEDIA_ROOT, name))
+        return f"{stat.st_size}\t{int(stat.st_mtime)}"
+
+    def is_done(self, name):
+        return name in self.done and self.done[name] == self.stamp(name)
+
+    def add(self, name):
+        self.done[name] = self.stamp(name)
+        with open(self.path, "a", encoding="utf-8") as manifest:
+            manifest.write(f"{name}\t{self.done[name]}\n")
+
+
+def claim_rendition_tasks(batch_size):
+    """
+    Забирает пачку задач очереди: короткая транзакция помечает их как
+    обрабатываемые, блокировки строк не держатся на время рендеринга.
+    Задачи упавшего воркера забираются снова через RENDITION_CLAIM_TIMEOUT.
+    """
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.RENDITION_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        tasks = list(
+            RenditionTask.objects.select_for_update(skip_locked=True).filter(
+                Q(status=RenditionTask.STATUS_PENDING)
+                | Q(status=RenditionTask.STATUS_PROCESSING, date_started__lt=abandoned)
+            )[:batch_size]
+        )
+        RenditionTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            status=RenditionTask.STATUS_PROCESSING, date_started=now
+        )
+    return tasks
+
+
+def process_rendition_tasks(executor, batch_size=None, manifest=None):
+    """
+    Обрабатывает пачку задач очереди рендиций в пуле executor.
+    Возвращает список результатов render_file.
+    """
+    tasks = claim_rendition_tasks(batch_size or settings.RENDITION_BATCH_SIZE)
+    results = list(executor.map(render_file, [task.name for task in tasks]))
+    done = []
+    # Задача, заново поставленная в очередь во время рендеринга, остаётся в очереди
+    claimed = RenditionTask.objects.filter(status=RenditionTask.STATUS_PROCESSING)
+    for task, (name, _, _, error) in zip(tasks, results):
+        if error:
+            claimed.filter(pk=task.pk).update(status=RenditionTask.STATUS_FAILED, last_error=error)
+        else:
+            done.append(task.pk)
+            if manifest is not None:
+                manifest.add(name)
+    claimed.filter(pk__in=done).update(
+        status=RenditionTask.STATUS_DONE, last_error="", date_done=timezone.now()
+    )
+    renditions_ready([name for name, _, _, error in results if not error])
+    return results
+
+
+def renditions_ready(names):
+    """
+    Сбрасывает кеши API, в которых изображения names отдавались без
+    рендиций: время обновления витрины товаров и версии ресурсов.
+    """
+    from .signals import MODEL_RESOURCES
+
+    names = list(names)
+    if not names:
+        return
+    touch_products(ProductImage.objects.filter(image__in=names).values_list("product_id", flat=True))
+    for model in (Brand, Animal, Article, Banner):
+        if model.objects.filter(image__in=names).exists():
+            bump_version(*MODEL_RESOURCES[model])
+
+
+def image_renditions(image, request=None):
+    """
+    Структура для <picture>/srcset: исходный файл и по одному srcset
+    на формат, или None, если изображения нет. Пока рендиции не созданы,
+    sources пуст: браузер не переходит на src, если <source> отдаёт 404.
+    """
+    if not image:
+        return None
+    storage = image.storage
+
+    def absolute(url):
+        return url if request is None else request.build_absolute_uri(url)
+
+    if not has_renditions(image):
+        return {"src": absolute(image.url), "sources": []}
+    return {
+        "src": absolute(image.url),
+        "sources": [
+            {
+                "type": mime_type,
+                "srcset": ", ".join(
+                    f"{absolute(storage.url(rendition_name(image.name, width, extension)))} {width}w"
+                    for width in settings.IMAGE_RENDITION_WIDTHS
+                ),
+            }
+            for extension, _, mime_type in RENDITION_FORMATS
+        ],
+    }
@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .cache import bump_version_on_commit
+from .models import Product, ProductListing, ProductOptions, SubCategory
+
+
+INDEX_FIELDS = (
+    "name",
+    "brand_id",
+    "popular",
+    "date_added",
+    "min_price",
+    "greatest_discount",
+    "animal_ids",
+    "category_ids",
+    "subcategory_ids",
+)
+
+
+def _active_discount(option):
+    discount = option.discount_by_product_option
+    if discount is not None and discount.is_active:
+        return discount.discount_amount
+    return None
+
+
+def _subcategory_discount(product):
+    # Как и pricing.DiscountSnapshot, учитываются только активные скидки
+    amounts = [
+        subcategory.discount_subcategory.discount_amount
+        for subcategory in product.subcategory.all()
+        if getattr(subcategory, "discount_subcategory", None) is not None
+        and subcategory.discount_subcategory.is_active
+    ]
+    return max(amounts) if amounts else None
+
+
+def build_listing(product):
+    """Строка витрины для товара или None, если товар не показывается"""
+    options = list(product.options.all())
+    if not product.is_active or not options:
+        return None
+    first_option = options[0]
+    discount_by_subcategory = _subcategory_discount(product)
+    first_option_discount = next(
+        (d for d in map(_active_discount, options) if d is not None), None
+    )
+    discounts = [d for d in (discount_by_subcategory, first_option_discount) if d is not None]
+    greatest_discount = max(discounts) if discounts else None
+    min_price = first_option.price
+    if greatest_discount is not None:
+        min_price = first_option.price * (100 - greatest_discount) / 100
+    return ProductListing(
+        product=product,
+        name=product.name,
+        brand_id=product.brand_id,
+        popular=product.popular,
+        date_added=product.date_added,
+        first_option=first_option,
+        min_price_options=first_option.price,
+        discount_by_subcategory=discount_by_subcategory,
+        first_option_discount=first_option_discount,
+        greatest_discount=greatest_discount,
+        min_price=min_price,
+        animal_ids=product.animal_ids or [],
+        category_ids=product.category_ids or [],
+        subcategory_ids=product.subcategory_ids or [],
+    )
+
+
+def refresh_product_listing(product_ids=None, batch_size=500):
+    """Пересчитывает витрину для переданных товаров (или для всех, если None)"""
+    products = Product.objects.prefetch_related(
+        Prefetch(
+            "options",
+            queryset=ProductOptions.objects.filter(is_active=True).select_related(
+                "discount_by_product_option"
+            ),
+        ),
+        Prefetch(
+            "subcategory",
+            queryset=SubCategory.objects.select_related("discount_subcategory"),
+        ),
+    )
+    listings = ProductListing.objects.all()
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        products = products.filter(pk__in=product_ids)
+        listings = listings.filter(product_id__in=product_ids)
+    rows = [row for row in map(build_listing, products) if row is not None]
+    with transaction.atomic():
+        before = _index_rows(listings) if product_ids is not None else None
+        listings.delete()
+        ProductListing.objects.bulk_create(rows, batch_size=batch_size)
+        after = _index_rows(listings) if product_ids is not None else None
+    resources = ["products", "brands"]
+    # Индексы в памяти процессов пересобираются, только если изменились
+    # их поля: списание остатков обычно меняет лишь JSON товара
+    if before is None or before != after:
+        resources.append("catalog_index")
+    if before is None or _names(before) != _names(after):
+        resources.append("suggest")
+    bump_version_on_commit(*resources)
+    return len(rows)
+
+
+def _index_rows(listings):
+    """Поля витрины, из которых строятся catalog_index и suggest, по товарам"""
+    return {row[0]: row for row in listings.values_list("product_id", *INDEX_FIELDS)}
+
+
+def _names(rows):
+    return {product_id: row[1] for product_id, row in rows.items()}
+
+
+def refresh_listing_for_options(option_ids):
+    product_ids = ProductOptions.objects.filter(id__in=option_ids).values_list(
+        "product_id", flat=True
+    )
+    return refresh_product_listing(product_ids)
+
+
+def refresh_listing_for_subcategories(subcategory_ids):
+    product_ids = Product.objects.filter(subcategory__in=subcategory_ids).values_list(
+        "id", flat=True
+    )
+    return refresh_product_listing(product_ids)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main import views  # noqa: F401  регистрирует закешированные списки
+from main.cache import STATS_COUNTERS, get_cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Счётчики кеша ответов API: hit, miss, stale, lock_wait"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Обнулить счётчики")
+
+    def handle(self, *args, **options):
+        stats = get_cache_stats()
+        self.stdout.write("{:<16}".format("") + "".join(f"{c:>12}" for c in STATS_COUNTERS))
+        for prefix, counters in stats.items():
+            self.stdout.write(
+                f"{prefix:<16}" + "".join(f"{counters[c]:>12}" for c in STATS_COUNTERS)
+            )
+        if options["reset"]:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Счётчики обнулены"))
@@ -0,0 +1,86 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.images import (
+    RenditionManifest,
+    iter_media_images,
+    process_rendition_tasks,
+    render_file,
+    renditions_ready,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт недостающие рендиции изображений из mediafiles в пуле процессов; "
+        "с --watch работает воркером очереди загрузок из админки"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.RENDITION_WORKERS, help="Число процессов")
+        parser.add_argument("--force", action="store_true", help="Игнорировать журнал и пересоздать всё")
+        parser.add_argument("--manifest", default=str(settings.IMAGE_RENDITION_MANIFEST))
+        parser.add_argument("--report-every", type=int, default=100, help="Отчёт каждые N файлов")
+        parser.add_argument("--watch", action="store_true", help="Обрабатывать очередь загрузок")
+        parser.add_argument("--once", action="store_true", help="Разобрать очередь один раз и выйти")
+        parser.add_argument("--interval", type=float, default=2, help="Пауза при пустой очереди, сек.")
+        parser.add_argument("--batch-size", type=int, default=settings.RENDITION_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        manifest = RenditionManifest(options["manifest"])
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            if options["watch"]:
+                self.watch(executor, manifest, options)
+            else:
+                self.backfill(executor, manifest, options)
+
+    def backfill(self, executor, manifest, options):
+        names = [
+            name for name in iter_media_images() if options["force"] or not manifest.is_done(name)
+        ]
+        self.stdout.write(f"Файлов к обработке: {len(names)} (процессов: {options['workers']})")
+        started = time.monotonic()
+        files = renditions = failed = 0
+        ready = []
+        chunksize = max(1, min(16, len(names) // (options["workers"] * 4)))
+        for name, count, _, error in executor.map(render_file, names, chunksize=chunksize):
+            files += 1
+            if error:
+                failed += 1
+                self.stderr.write(f"{name}: {error}")
+            else:
+                renditions += count
+                manifest.add(name)
+                ready.append(name)
+            if files % options["report_every"] == 0:
+                renditions_ready(ready)
+                ready = []
+                self.report(files, len(names), renditions, failed, time.monotonic() - started)
+        renditions_ready(ready)
+        self.report(files, len(names), renditions, failed, time.monotonic() - started)
+
+    def watch(self, executor, manifest, options):
+        while True:
+            results = process_rendition_tasks(executor, options["batch_size"], manifest)
+            for name, count, seconds, error in results:
+                if error:
+                    self.stderr.write(f"{name}: {error}")
+                else:
+                    self.stdout.write(f"{name}: {count} рендиций за {seconds:.2f} с")
+            if not results:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+
+    def report(self, files, total, renditions, failed, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        self.stdout.write(
+            f"{files}/{total} файлов, рендиций: {renditions}, ошибок: {failed}, "
+            f"{files / elapsed:.1f} файл/с, {renditions / elapsed:.1f} рендиций/с"
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.listing import refresh_product_listing
+
+
+class Command(BaseCommand):
+    help = "Полностью пересобирает витрину каталога (ProductListing)"
+
+    def handle(self, *args, **options):
+        count = refresh_product_listing()
+        self.stdout.write(self.style.SUCCESS(f"Витрина пересобрана: {count} товаров"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.search import update_search_vector
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает поисковый вектор (search_vector) всех товаров"
+
+    def handle(self, *args, **options):
+        count = update_search_vector()
+        self.stdout.write(self.style.SUCCESS(f"Поисковый индекс обновлён: {count} товаров"))
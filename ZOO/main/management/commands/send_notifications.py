@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.services import send_pending_notifications
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди уведомлений: отправляет сообщения в Telegram пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Обработать очередь один раз и выйти")
+        parser.add_argument("--interval", type=float, default=2, help="Пауза при пустой очереди, сек.")
+        parser.add_argument("--batch-size", type=int, default=settings.NOTIFICATIONS_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            processed = send_pending_notifications(options["batch_size"])
+            if processed:
+                self.stdout.write(f"Обработано уведомлений: {processed}")
+            if options["once"]:
+                if not processed:
+                    break
+                continue
+            if not processed:
+                time.sleep(options["interval"])
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.recommendations import Recommend
+
+
+class Command(BaseCommand):
+    help = "Воркер рекомендаций: переносит совместные покупки из очереди в Redis"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Разобрать очередь один раз и выйти")
+        parser.add_argument("--interval", type=float, default=5, help="Пауза при пустой очереди, сек.")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        recommend = Recommend()
+        while True:
+            processed = recommend.process_queue(options["batch_size"])
+            if processed:
+                self.stdout.write(f"Обработано заказов: {processed}")
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["interval"])
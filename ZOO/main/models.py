@@ -1,9 +1,13 @@
-from functools import reduce
 from ckeditor.fields import RichTextField
 from colorfield.fields import ColorField
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 from imagekit.models import ProcessedImageField
 from smart_selects.db_fields import ChainedManyToManyField
 
@@ -65,14 +69,15 @@ NUM_ORDERING = (
 
 class MyManager(models.Manager):
     def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
-        results = super(MyManager, self).bulk_create(
-            objs, batch_size=None, ignore_conflicts=False
+        """Создаёт фасовки и одним запросом пересчитывает активность их товаров"""
+        objs = super(MyManager, self).bulk_create(
+            objs, batch_size=batch_size, ignore_conflicts=ignore_conflicts
         )
-        filter_of_result = set(map(lambda option: option.product, results))
-        for result in filter_of_result:
-            if result.options.filter(is_active=True).count() < 1:
-                result.is_active = False
-        Product.objects.bulk_update(filter_of_result, ["is_active"])
+
+        from .activity import touch_products
+
+        touch_products({option.product_id for option in objs})
+        return objs
 
 
 class Product(models.Model):
@@ -164,10 +169,18 @@ class Product(models.Model):
         models.BigIntegerField(null=True),
         null=True,
     )
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = "ПРОДУКТ"
         verbose_name_plural = "ПРОДУКТЫ"
+        indexes = (
+            GinIndex(fields=("search_vector",), name="product_search_vector_gin"),
+            GinIndex(fields=("name",), name="product_name_trgm", opclasses=("gin_trgm_ops",)),
+            GinIndex(fields=("animal_ids",), name="product_animal_ids_gin"),
+            GinIndex(fields=("category_ids",), name="product_category_ids_gin"),
+            GinIndex(fields=("subcategory_ids",), name="product_subcategory_ids_gin"),
+        )
 
     def __str__(self):
         return self.name
@@ -217,6 +230,16 @@ class Units(models.Model):
     def __str__(self):
         return self.unit_name
 
+    @classmethod
+    def grams_id(cls):
+        """id единицы "г" для развесных фасовок; кешируется до изменения единиц"""
+        from .cache import get_versions
+
+        key = f"UNITS_GRAMS_ID:{get_versions(('units',))[0]}"
+        return cache.get_or_set(
+            key, lambda: cls.objects.get(unit_name="г").pk, settings.CACHE_VERSIONED_TTL
+        )
+
     class Meta:
         verbose_name = "Еденица измерения"
         verbose_name_plural = "ЕДИНИЦЫ ИЗМЕРЕНИЯ"
@@ -292,28 +315,68 @@ class ProductOptions(models.Model):
             self.is_active = False
         if self.partial is True:
             self.size = 1000
-            self.units = Units.objects.get(unit_name="г")
+            self.units_id = Units.grams_id()
         super(ProductOptions, self).save(*args, **kwargs)
 
-        if (
-            self.product.options.exclude(article_number=self.article_number)
-            .filter(is_active=True)
-            .count()
-            == 0
-            and self.is_active is False
-        ):
-            self.product.is_active = False
-        else:
-            self.product.is_active = True
-        self.product.save()
+        from .activity import touch_products
+
+        touch_products((self.product_id,))
 
     def get_animal(self):
-        # return 1
-        return reduce(lambda x, y: f"{x}/{y}", self.product.animal.all())
+        # Животные товара берутся из prefetch_related("product__animal") админки
+        return "/".join(animal.name for animal in self.product.animal.all())
 
     get_animal.short_description = "Животное"
 
 
+class ProductListing(models.Model):
+    """Витрина каталога: предрассчитанные цены и скидки активных товаров"""
+
+    product = models.OneToOneField(
+        "Product",
+        primary_key=True,
+        related_name="listing",
+        on_delete=models.CASCADE,
+    )
+    name = models.CharField(max_length=255, db_index=True)
+    brand = models.ForeignKey(
+        "Brand",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+        db_index=True,
+    )
+    popular = models.IntegerField(default=0, db_index=True)
+    date_added = models.DateTimeField(db_index=True)
+    first_option = models.ForeignKey(
+        "ProductOptions",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    min_price_options = models.DecimalField(max_digits=8, decimal_places=2)
+    discount_by_subcategory = models.PositiveIntegerField(null=True)
+    first_option_discount = models.PositiveIntegerField(null=True)
+    greatest_discount = models.PositiveIntegerField(null=True, db_index=True)
+    min_price = models.DecimalField(max_digits=12, decimal_places=4, db_index=True)
+    animal_ids = ArrayField(models.BigIntegerField(), default=list)
+    category_ids = ArrayField(models.BigIntegerField(), default=list)
+    subcategory_ids = ArrayField(models.BigIntegerField(), default=list)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Витрина товара"
+        verbose_name_plural = "ВИТРИНА ТОВАРОВ"
+        indexes = (
+            GinIndex(fields=("animal_ids",), name="listing_animal_ids_gin"),
+            GinIndex(fields=("category_ids",), name="listing_category_ids_gin"),
+            GinIndex(fields=("subcategory_ids",), name="listing_subcategory_ids_gin"),
+        )
+
+    def __str__(self):
+        return self.name
+
+
 class Animal(models.Model):
     """Доступные типы животных для поиска товаров"""
     ORDER_CHOICES = (
@@ -335,6 +398,9 @@ class Animal(models.Model):
         upload_to="photos_animal/",
     )
     num_ordering = models.IntegerField(verbose_name="Очерёдность показа", choices=ORDER_CHOICES, default=1)
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     class Meta:
         verbose_name = "ЖИВОТНОГО"
@@ -361,6 +427,9 @@ class Brand(models.Model):
         blank=True,
         upload_to="photos_brand/",
     )
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     class Meta:
         verbose_name = "БРЕНД"
@@ -388,6 +457,9 @@ class Category(models.Model):
         verbose_name="Животное"
     )
     num_ordering = models.IntegerField(verbose_name="Очерёдность показа", choices=NUM_ORDERING, default=1)
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     class Meta:
         verbose_name = "КАТЕГОРИИ"
@@ -415,6 +487,9 @@ class SubCategory(models.Model):
     )
     is_active = models.BooleanField(verbose_name="Активно", default=True)
     num_ordering = models.IntegerField(verbose_name="Очерёдность показа", choices=NUM_ORDERING, default=1)
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     def __str__(self):
         return f"{self.name} <{self.category.animal.name.upper()}>"
@@ -553,6 +628,9 @@ class InfoShop(models.Model):
         blank=True,
         config_name="custom",
     )
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     class Meta:
         verbose_name = "О магазине"
@@ -587,6 +665,9 @@ class InfoShopMainPage(models.Model):
         blank=True,
         upload_to="photos_main_page/",
     )
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     def __str__(self):
         return ""
@@ -608,6 +689,9 @@ class InfoShopBlock(models.Model):
         verbose_name="Заголовок Блока", max_length=255, blank=True, null=True
     )
     info_text = models.TextField(verbose_name="Описание Блока", blank=True, null=True)
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     class Meta:
         verbose_name = "Блок о магазине"
@@ -830,6 +914,9 @@ class DiscountBySubCategory(models.Model):
         help_text="Процент скидки не должен быть меньше 1% и превышать 100%",
         validators=[MinValueValidator(1), MaxValueValidator(100)],
     )
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     def __str__(self):
         return f"Скидка {self.discount_amount}% на - {self.subcategory.name}"
@@ -856,6 +943,9 @@ class DiscountByDay(models.Model):
     week_days = ArrayField(
         models.IntegerField(choices=DAYS_DISCOUNT_CHOICES, null=True), null=True
     )
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     def __str__(self):
         return f"{self.title}"
@@ -880,6 +970,9 @@ class DiscountByDayOptions(models.Model):
         help_text="Процент скидки не должен быть меньше 1% и превышать 100%",
         validators=[MinValueValidator(1), MaxValueValidator(100)],
     )
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     def __str__(self):
         return f"Мин. сумма для скидки: {self.min_price_for_discount}, Скидка: {self.discount_amount}%"
@@ -911,6 +1004,9 @@ class Banner(models.Model):
     info_shop = models.ForeignKey(
         "InfoShop", related_name="banners", on_delete=models.CASCADE, null=True,)
         # default=InfoShop.objects.all().first().id)
+    date_updated = models.DateTimeField(
+        verbose_name="Дата обновления", auto_now=True, blank=True, null=True
+    )
 
     def save(self, *args, **kwargs):
         if InfoShop.objects.all().exists():
@@ -923,3 +1019,78 @@ class Banner(models.Model):
     class Meta:
         verbose_name = "Рекламный Баннер"
         verbose_name_plural = "РЕКЛАМНЫЕ БАННЕРЫ"
+
+
+class Notification(models.Model):
+    """Очередь уведомлений в Telegram (outbox)"""
+
+    STATUS_PENDING = 0
+    STATUS_SENT = 1
+    STATUS_FAILED = 2
+    STATUS_SENDING = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_SENDING, "Отправляется"),
+        (STATUS_SENT, "Отправлено"),
+        (STATUS_FAILED, "Не отправлено"),
+    )
+    text = models.TextField(verbose_name="Текст сообщения")
+    status = models.IntegerField(
+        verbose_name="Статус", choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(verbose_name="Попыток отправки", default=0)
+    next_attempt = models.DateTimeField(
+        verbose_name="Следующая попытка", default=timezone.now
+    )
+    last_error = models.TextField(verbose_name="Последняя ошибка", blank=True)
+    date_attempt = models.DateTimeField(verbose_name="Начало попытки", null=True, blank=True)
+    date_created = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    date_sent = models.DateTimeField(verbose_name="Дата отправки", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Уведомление"
+        verbose_name_plural = "УВЕДОМЛЕНИЯ"
+        ordering = ("id",)
+        indexes = [models.Index(fields=("status", "next_attempt"))]
+
+    def __str__(self):
+        return f"{self.get_status_display()}: {self.text[:50]}"
+
+
+class RenditionTask(models.Model):
+    """Очередь генерации рендиций загруженных изображений"""
+
+    STATUS_PENDING = 0
+    STATUS_DONE = 1
+    STATUS_FAILED = 2
+    STATUS_PROCESSING = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_PROCESSING, "Обрабатывается"),
+        (STATUS_DONE, "Готово"),
+        (STATUS_FAILED, "Ошибка"),
+    )
+    name = models.CharField(verbose_name="Файл изображения", max_length=255, unique=True)
+    status = models.IntegerField(
+        verbose_name="Статус", choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    last_error = models.TextField(verbose_name="Ошибка", blank=True)
+    date_created = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    date_started = models.DateTimeField(verbose_name="Взята в работу", null=True, blank=True)
+    date_done = models.DateTimeField(verbose_name="Дата обработки", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Рендиции изображения"
+        verbose_name_plural = "ОЧЕРЕДЬ РЕНДИЦИЙ"
+        ordering = ("id",)
+        indexes = [models.Index(fields=("status", "id"))]
+
+    def __str__(self):
+        return f"{self.get_status_display()}: {self.name}"
+
+    @classmethod
+    def enqueue(cls, name):
+        cls.objects.update_or_create(
+            name=name,
+            defaults={"status": cls.STATUS_PENDING, "last_error": "", "date_started": None, "date_done": None},
+        )
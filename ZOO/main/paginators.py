@@ -0,0 +1,49 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset, threshold=None):
+    """
+    Число строк queryset: оценка Postgres, если она не меньше threshold
+    (по умолчанию ESTIMATED_COUNT_THRESHOLD), иначе точный COUNT(*).
+    Для queryset без фильтров оценка берётся из pg_class.reltuples,
+    для отфильтрованного - из плана EXPLAIN.
+    """
+    threshold = settings.ESTIMATED_COUNT_THRESHOLD if threshold is None else threshold
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count()
+    query = queryset.query
+    if not query.where and not query.distinct and query.group_by is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples < 0, если таблицу ещё не анализировали
+        estimate = row[0] if row else -1
+    else:
+        plan = json.loads(queryset.order_by().explain(format="json"))
+        estimate = plan[0]["Plan"]["Plan Rows"]
+    if estimate >= threshold:
+        return int(estimate)
+    return queryset.count()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для больших таблиц: число строк берётся из оценки Postgres
+    (см. estimated_count) вместо COUNT(*), если оно выше порога.
+    """
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return estimated_count(self.object_list)
+        return super().count
@@ -0,0 +1,112 @@
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Context, Decimal, localcontext
+
+from django.utils import timezone
+
+from .models import DiscountByDayOptions, DiscountBySubCategory, ProductOptions
+
+CENT = Decimal("0.01")
+HUNDRED = Decimal(100)
+GRAMS_IN_KG = Decimal(1000)
+
+BasketTotals = namedtuple("BasketTotals", ("total_no_discount", "total_with_discount"))
+
+
+def pricing_context():
+    """Локальный контекст Decimal: не трогает глобальную точность потока"""
+    return localcontext(Context(prec=28, rounding=ROUND_HALF_UP))
+
+
+def discounted_price(price, discount):
+    return (Decimal(price) * (HUNDRED - discount) / HUNDRED).quantize(CENT, ROUND_HALF_UP)
+
+
+def line_quantity(quantity, partial):
+    quantity = Decimal(quantity)
+    return quantity / GRAMS_IN_KG if partial else quantity
+
+
+def apply_day_discount(amount, day_discounts):
+    """day_discounts - [(сумма от, процент)] по убыванию суммы"""
+    for min_price_for_discount, discount_amount in day_discounts:
+        if amount >= min_price_for_discount:
+            return discounted_price(amount, discount_amount)
+    return amount
+
+
+class DiscountSnapshot:
+    """Действующие скидки на фасовки, подкатегории и день недели"""
+
+    def __init__(self, option_discounts, product_discounts, day_discounts):
+        self.option_discounts = option_discounts
+        self.product_discounts = product_discounts
+        self.day_discounts = day_discounts
+
+    @classmethod
+    def load(cls, options, weekday=None):
+        option_ids = {option.pk for option in options}
+        product_ids = {option.product_id for option in options}
+        weekday = timezone.localdate().weekday() if weekday is None else weekday
+        option_discounts = dict(
+            ProductOptions.objects.filter(
+                pk__in=option_ids, discount_by_product_option__is_active=True
+            ).values_list("pk", "discount_by_product_option__discount_amount")
+        )
+        product_discounts = {}
+        for product_id, discount_amount in DiscountBySubCategory.objects.filter(
+            is_active=True, subcategory__products__in=product_ids
+        ).values_list("subcategory__products", "discount_amount"):
+            product_discounts[product_id] = max(
+                discount_amount, product_discounts.get(product_id, 0)
+            )
+        day_discounts = list(
+            DiscountByDayOptions.objects.filter(
+                discount_by_day__is_active=True,
+                discount_by_day__week_days__contains=[weekday],
+            )
+            .order_by("-min_price_for_discount")
+            .values_list("min_price_for_discount", "discount_amount")
+        )
+        return cls(option_discounts, product_discounts, day_discounts)
+
+    def discount_for(self, option):
+        discounts = [
+            discount
+            for discount in (
+                self.option_discounts.get(option.pk),
+                self.product_discounts.get(option.product_id),
+            )
+            if discount
+        ]
+        return max(discounts) if discounts else None
+
+
+def price_basket(lines, snapshot):
+    """
+    Считает корзину по серверным ценам. lines - [(ProductOptions, количество)].
+    Скидка по дню недели применяется только к товарам без других скидок.
+    """
+    with pricing_context():
+        full_price = Decimal(0)
+        discounted = Decimal(0)
+        not_discounted = Decimal(0)
+        for option, quantity in lines:
+            quantity = line_quantity(quantity, option.partial)
+            full_price += option.price * quantity
+            discount = snapshot.discount_for(option)
+            if discount:
+                discounted += discounted_price(option.price, discount) * quantity
+            else:
+                not_discounted += option.price * quantity
+        not_discounted = apply_day_discount(not_discounted, snapshot.day_discounts)
+        return BasketTotals(
+            total_no_discount=full_price.quantize(CENT, ROUND_HALF_UP),
+            total_with_discount=(discounted + not_discounted).quantize(CENT, ROUND_HALF_UP),
+        )
+
+
+def price_baskets(baskets, weekday=None):
+    """Считает много корзин с одним снимком скидок на все их фасовки"""
+    options = [option for lines in baskets for option, _ in lines]
+    snapshot = DiscountSnapshot.load(options, weekday=weekday)
+    return [price_basket(lines, snapshot) for lines in baskets]
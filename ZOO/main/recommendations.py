@@ -1,25 +1,83 @@
+import json
+
 import redis
 from django.conf import settings
+from django.core.cache import cache
 
 r = redis.Redis(host=settings.REDIS_HOST,
                 port=settings.REDIS_PORT,
                 db=settings.REDIS_DB,)
 
+QUEUE_KEY = 'recommend:purchases'
+SUGGESTIONS_CACHE_KEY = 'ACCOMPANYING_GOODS:{}'
+
+# KEYS - ключи товаров корзины, ARGV[1] - предел размера множества,
+# ARGV[2..] - id тех же товаров. Множество подрезается до предела, когда
+# вырастает на четверть сверх него, чтобы не делать ZREMRANGEBYRANK каждый раз.
+PRODUCTS_BOUGHT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+for i = 1, #KEYS do
+    for j = 2, #ARGV do
+        if j ~= i + 1 then
+            redis.call('ZINCRBY', KEYS[i], 1, ARGV[j])
+        end
+    end
+    if limit > 0 and redis.call('ZCARD', KEYS[i]) > limit + math.floor(limit / 4) then
+        redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -limit - 1)
+    end
+end
+return #KEYS
+"""
+
 
 class Recommend:
+    products_bought_script = r.register_script(PRODUCTS_BOUGHT_SCRIPT)
 
     def get_product_key(self, id):
         return f'product:{id}:purchased_with'
 
+    def _product_ids(self, products):
+        return list(dict.fromkeys(p['id'] for p in products))
+
+    def _record(self, product_ids, client):
+        if len(product_ids) < 2:
+            return
+        self.products_bought_script(
+            keys=[self.get_product_key(product_id) for product_id in product_ids],
+            args=[settings.RECOMMEND_MAX_RELATED, *product_ids],
+            client=client,
+        )
+
+    def invalidate_suggestions(self, product_ids):
+        cache.delete_many([SUGGESTIONS_CACHE_KEY.format(product_id) for product_id in product_ids])
+
     def products_bought(self, products):
-        product_ids = [p['id'] for p in products]
-        for product_id in product_ids:
-            for with_id in product_ids:
-                if product_id != with_id:
-                    r.zincrby(self.get_product_key(product_id), 1, with_id)
+        """Один вызов Lua-скрипта на заказ, независимо от размера корзины"""
+        product_ids = self._product_ids(products)
+        if settings.RECOMMEND_ASYNC:
+            if len(product_ids) > 1:
+                r.rpush(QUEUE_KEY, json.dumps(product_ids))
+        else:
+            self._record(product_ids, r)
+            self.invalidate_suggestions(product_ids)
+
+    def process_queue(self, batch_size=100):
+        """Переносит накопленные заказы из очереди в рекомендации"""
+        with r.pipeline() as pipe:
+            pipe.lrange(QUEUE_KEY, 0, batch_size - 1)
+            pipe.ltrim(QUEUE_KEY, batch_size, -1)
+            baskets, _ = pipe.execute()
+        if baskets:
+            with r.pipeline(transaction=False) as pipe:
+                baskets = [json.loads(basket) for basket in baskets]
+                for product_ids in baskets:
+                    self._record(product_ids, pipe)
+                pipe.execute()
+            self.invalidate_suggestions({p for product_ids in baskets for p in product_ids})
+        return len(baskets)
 
     def suggest_products_for(self, product_id, max_results=12):
         name = self.get_product_key(product_id)
-        suggestions = r.zrange(name, 0, -1, desc=True)[:max_results]
+        suggestions = r.zrevrange(name, 0, max_results - 1)
         suggested_products_ids = [int(id) for id in suggestions]
         return suggested_products_ids
@@ -0,0 +1,78 @@
+import json
+
+from django.conf import settings
+from rest_framework.utils import encoders
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # без orjson работаем через стандартный json
+    orjson = None
+
+FRAGMENTS_PLACEHOLDER = "\x00fragments\x00"
+
+_encoder = encoders.JSONEncoder()
+
+
+def encode_json(data):
+    """
+    JSON в байтах как у JSONRenderer DRF: Decimal, datetime и прочие типы
+    кодируются encoders.JSONEncoder, \\u2028 и \\u2029 экранируются.
+    """
+    if orjson is not None:
+        encoded = orjson.dumps(
+            data,
+            default=_encoder.default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+    else:
+        encoded = json.dumps(
+            data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+    if b"\xe2\x80\xa8" in encoded or b"\xe2\x80\xa9" in encoded:
+        encoded = encoded.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return encoded
+
+
+class EncodedFragments(list):
+    """Список уже закодированных JSON-значений (bytes), вставляется в ответ как массив"""
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson. Значения верхнего уровня типа EncodedFragments
+    не кодируются заново, а склеиваются из готовых байтов.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if not isinstance(data, dict):
+            return encode_json(data)
+        fragments = {key: value for key, value in data.items() if isinstance(value, EncodedFragments)}
+        if not fragments:
+            return encode_json(data)
+        placeholders = {key: f"{FRAGMENTS_PLACEHOLDER}{key}" for key in fragments}
+        encoded = encode_json({key: placeholders.get(key, value) for key, value in data.items()})
+        for key, value in fragments.items():
+            encoded = encoded.replace(
+                encode_json(placeholders[key]), b"[" + b",".join(value) + b"]", 1
+            )
+        return encoded
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace("-", "") != "utf8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
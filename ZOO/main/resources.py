@@ -2,9 +2,36 @@
 from import_export import fields, resources, widgets
 
 from import_export.instance_loaders import CachedInstanceLoader
+from .cache import bump_version_on_commit
+from .listing import refresh_product_listing
+from .search import update_search_vector
 from .models import Animal, Brand, Category, Product, ProductOptions, SubCategory, Units
 
 
+def bulk_get_or_create(model, key_fields, keys):
+    """
+    Словарь {значения key_fields: объект} для всех keys: существующие строки
+    читаются одним запросом, недостающие создаются одним bulk_create.
+    """
+    keys = set(keys)
+    found = {}
+    if keys:
+        lookups = {
+            f"{field}__in": {key[i] for key in keys}
+            for i, field in enumerate(key_fields)
+        }
+        for obj in model.objects.filter(**lookups).order_by("pk"):
+            key = tuple(getattr(obj, field) for field in key_fields)
+            if key in keys:
+                found.setdefault(key, obj)
+    missing = [
+        model(**dict(zip(key_fields, key))) for key in keys - found.keys()
+    ]
+    for obj in model.objects.bulk_create(missing):
+        found[tuple(getattr(obj, field) for field in key_fields)] = obj
+    return found
+
+
 class ProductOptionsResource(resources.ModelResource):
     article_number = fields.Field(column_name="Артикул", attribute="article_number",
                                   widget=widgets.CharWidget())
@@ -48,6 +75,78 @@ class ProductOptionsResource(resources.ModelResource):
         use_bulk = True
         instance_loader_class = CachedInstanceLoader
 
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        """
+        Готовит справочники для всего файла разом: загружает существующие
+        животные, категории, подкатегории, бренды, товары и единицы измерения в
+        словари по названию, недостающие создаёт через bulk_create и заранее
+        проставляет товарам бренд и связи. Строки файла дальше только читают
+        эти словари.
+        """
+        self.touched_products = set()
+        rows = []
+        for row in dataset.dict:
+            self.before_import_row(row)
+            rows.append(self.row_dimensions())
+
+        self.animals = bulk_get_or_create(
+            Animal, ("name",), {(animal,) for row in rows for animal, _, _ in row["chain"]}
+        )
+        self.categories = bulk_get_or_create(
+            Category,
+            ("name", "animal_id"),
+            {(category, self.animals[(animal,)].id) for row in rows for animal, category, _ in row["chain"]},
+        )
+        self.subcategories = bulk_get_or_create(
+            SubCategory,
+            ("name", "category_id"),
+            {
+                (sub_category, self.categories[(category, self.animals[(animal,)].id)].id)
+                for row in rows
+                for animal, category, sub_category in row["chain"]
+            },
+        )
+        self.brands = bulk_get_or_create(Brand, ("name",), {(row["brand"],) for row in rows})
+        self.products = bulk_get_or_create(Product, ("name",), {(row["product"],) for row in rows})
+        self.units_cache = bulk_get_or_create(Units, ("unit_name",), {(row["units"],) for row in rows})
+
+        # Как и при построчном импорте, связи товара берутся из последней его строки
+        relations = {}
+        for row in rows:
+            product = self.products[(row["product"],)]
+            product.brand = self.brands[(row["brand"],)]
+            animal_ids, category_ids, subcategory_ids = [], [], []
+            for animal, category, sub_category in row["chain"]:
+                animal_ids.append(self.animals[(animal,)].id)
+                category_ids.append(self.categories[(category, animal_ids[-1])].id)
+                subcategory_ids.append(self.subcategories[(sub_category, category_ids[-1])].id)
+            product.animal_ids = animal_ids
+            product.category_ids = category_ids
+            product.subcategory_ids = subcategory_ids
+            relations[product.id] = product
+        products = list(relations.values())
+        Product.objects.bulk_update(
+            products,
+            ["brand", "animal_ids", "category_ids", "subcategory_ids"],
+            batch_size=self._meta.batch_size,
+        )
+        for relation, ids_attr, column in (
+            (Product.animal, "animal_ids", "animal_id"),
+            (Product.category, "category_ids", "category_id"),
+            (Product.subcategory, "subcategory_ids", "subcategory_id"),
+        ):
+            through = relation.through
+            through.objects.filter(product_id__in=relations).delete()
+            through.objects.bulk_create(
+                [
+                    through(product_id=product.id, **{column: related_id})
+                    for product in products
+                    for related_id in getattr(product, ids_attr)
+                ],
+                batch_size=self._meta.batch_size,
+                ignore_conflicts=True,
+            )
+
     def before_import_row(self, row, row_number=None, **kwargs):
         self.brand = row["Бренд"].strip()
         self.animal = row["Животное"].strip()
@@ -68,76 +167,32 @@ class ProductOptionsResource(resources.ModelResource):
             self.units = "г"
             self.stock_balance *= 1000
 
-    def after_import_instance(self, instance, new, row_number=None, **kwargs):
+    def row_dimensions(self):
+        """Названия справочников текущей строки: цепочки животное-категория-подкатегория"""
+        return {
+            "chain": [
+                (animal.capitalize(), self.category, self.sub_category)
+                for animal in self.animal.split("/")
+            ],
+            "brand": self.brand,
+            "product": self.product,
+            "units": self.units,
+        }
 
-        if "/" in self.animal:
-            list_animal = self.animal.split("/")
-            animals_list = []
-            categories_list = []
-            subcat_list = []
-            for new_animal in list_animal:
-                animal, created = Animal.objects.get_or_create(
-                    name=new_animal.capitalize()
-                )
-                animals_list.append(animal.id)
-                category, created = Category.objects.get_or_create(
-                    name=self.category, animal=animal
-                )
-                categories_list.append(category.id)
-                sub_category, created = SubCategory.objects.get_or_create(
-                    name=self.sub_category, category=category
-                )
-                subcat_list.append(sub_category.id)
-                brand, created = Brand.objects.get_or_create(name=self.brand)
-                product, created = Product.objects.get_or_create(
-                    name=self.product,
-                )
-            product.brand = brand
-            product.animal.set(animals_list)
-            product.category.set(categories_list)
-            product.subcategory.set(subcat_list)
-            product.animal_ids = animals_list
-            product.category_ids = categories_list
-            product.subcategory_ids = subcat_list
-        else:
-            animal, created = Animal.objects.get_or_create(
-                name=self.animal.capitalize()
-            )
-            category, created = Category.objects.get_or_create(
-                name=self.category, animal=animal
-            )
-            sub_category, created = SubCategory.objects.get_or_create(
-                name=self.sub_category, category=category
-            )
-            brand, created = Brand.objects.get_or_create(name=self.brand)
-            product, created = Product.objects.get_or_create(
-                name=self.product
-            )
-            product.brand = brand
-            product.animal.set((animal,))
-            product.category.set((category,))
-            product.subcategory.set((sub_category,))
-            product.animal_ids = [animal.id]
-            product.category_ids = [category.id]
-            product.subcategory_ids = [sub_category.id]
-        product.save()
-        unit_instance, is_created_unit = Units.objects.get_or_create(
-            unit_name=self.units
-        )
+    def after_import_instance(self, instance, new, row_number=None, **kwargs):
+        product = self.products[(self.product,)]
         if self.stock_balance <= 0:
             instance.is_active = False
         if self.partial == "кг":
-            unit_for_partial, created_unit = Units.objects.get_or_create(
-                unit_name="г"
-            )
             instance.partial = 1
-            instance.units = unit_for_partial
+            instance.units = self.units_cache[("г",)]
             instance.size = 1000
             instance.stock_balance = self.stock_balance * 1000
         else:
-            instance.units = unit_instance
+            instance.units = self.units_cache[(self.units,)]
             instance.size = self.size
         instance.product = product
+        self.touched_products.add(product.id)
 
     def get_bulk_update_fields(self):
         not_bulk_fields = (
@@ -158,3 +213,10 @@ class ProductOptionsResource(resources.ModelResource):
             else:
                 instance.is_active = True
         super().bulk_update(using_transactions, dry_run, raise_errors, batch_size=None)
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        super().after_import(dataset, result, using_transactions, dry_run, **kwargs)
+        if not dry_run:
+            bump_version_on_commit("animals", "categories", "suggest")
+            update_search_vector(self.touched_products)
+            refresh_product_listing(self.touched_products)
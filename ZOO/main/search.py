@@ -0,0 +1,86 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db.models import F, Func, OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Brand, Product
+
+WORD_RE = re.compile(r"\w+")
+
+
+class StripTags(Func):
+    """HTML из RichTextField без тегов, чтобы они не попадали в индекс"""
+
+    function = "REGEXP_REPLACE"
+    template = "%(function)s(%(expressions)s, '<[^>]*>', ' ', 'g')"
+    output_field = TextField()
+
+
+def _document(expression, weight):
+    return SearchVector(
+        Coalesce(expression, Value(""), output_field=TextField()),
+        weight=weight,
+        config=settings.SEARCH_CONFIG,
+    )
+
+
+def search_vector():
+    brand_name = Subquery(Brand.objects.filter(pk=OuterRef("brand_id")).values("name")[:1])
+    return (
+        _document(F("name"), "A")
+        + _document(brand_name, "A")
+        + _document(StripTags("features"), "B")
+        + _document(StripTags("description"), "C")
+        + _document(StripTags("composition"), "D")
+    )
+
+
+def update_search_vector(product_ids=None):
+    """Пересчитывает сохранённый search_vector одним UPDATE (для всех, если None)"""
+    products = Product.objects.all()
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        products = products.filter(pk__in=product_ids)
+    return products.update(search_vector=search_vector())
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Полнотекстовый поиск по search_vector с префиксным совпадением слов.
+    Если ничего не нашлось, ищет по похожести названия (опечатки).
+    Без параметра ordering результаты сортируются по релевантности.
+    """
+
+    search_param = "search"
+    ordering_param = "ordering"
+
+    def filter_queryset(self, request, queryset, view):
+        words = WORD_RE.findall(request.query_params.get(self.search_param, ""))
+        if not words:
+            return queryset
+        query = SearchQuery(
+            " & ".join(f"{word}:*" for word in words),
+            search_type="raw",
+            config=settings.SEARCH_CONFIG,
+        )
+        results = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F("search_vector"), query)
+        )
+        if not results.exists():
+            text = " ".join(words)
+            results = queryset.filter(name__trigram_word_similar=text).annotate(
+                search_rank=TrigramWordSimilarity(text, "name")
+            )
+        if request.query_params.get(self.ordering_param):
+            return results
+        return results.order_by("-search_rank", "id")
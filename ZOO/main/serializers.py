@@ -25,9 +25,22 @@ from .models import (
     SubCategory,
     Units,
 )
+from .images import image_renditions
 from .validators import name_validator, phone_validator
 
 
+class RenditionsField(serializers.Field):
+    """Рендиции изображения для srcset, по умолчанию из поля image"""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        kwargs.setdefault("source", "image")
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return image_renditions(value, self.context.get("request"))
+
+
 class DiscountByProductOptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = DiscountByProductOption
@@ -76,11 +89,13 @@ class ProductOptionsSerializer(serializers.ModelSerializer):
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = ProductImage
-        exclude = (
-            "id",
-            "product",
+        fields = (
+            "image",
+            "renditions",
         )
 
 
@@ -117,6 +132,19 @@ class CategorySerializer(serializers.ModelSerializer):
         )
 
 
+class BrandSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
+    class Meta:
+        model = Brand
+        fields = (
+            "id",
+            "name",
+            "image",
+            "renditions",
+        )
+
+
 class ProductSerializer(serializers.ModelSerializer):
     options = ProductOptionsSerializer(many=True)
     # chosen_option = serializers.SerializerMethodField()
@@ -148,6 +176,8 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class ProductDetailSerializer(ProductSerializer):
+    brand = BrandSerializer(read_only=True)
+
     class Meta:
         model = Product
         fields = (
@@ -167,27 +197,119 @@ class ProductDetailSerializer(ProductSerializer):
         depth = 1
 
 
-class BrandSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Brand
-        fields = (
-            "id",
-            "name",
-            "image",
-        )
+# Быстрый путь для списка и карточки товара: тот же JSON, что у
+# ProductSerializer/ProductDetailSerializer, но без декларативных полей -
+# значения читаются атрибутами уже загруженных объектов.
+DECIMAL_8_2 = serializers.DecimalField(max_digits=8, decimal_places=2)
+
+
+def _decimal(value):
+    return None if value is None else DECIMAL_8_2.to_representation(value)
+
+
+def _integer(value):
+    return None if value is None else int(value)
+
+
+def _file_url(value, request):
+    if not value:
+        return None
+    try:
+        url = value.url
+    except AttributeError:
+        return None
+    return url if request is None else request.build_absolute_uri(url)
+
+
+def _option(option):
+    discount = option.discount_by_product_option
+    units = option.units
+    return {
+        "id": option.id,
+        "is_active": option.is_active,
+        "discount_by_option": None if discount is None else discount.discount_amount,
+        "article_number": option.article_number,
+        "units": None if units is None else {"unit_name": units.unit_name},
+        "quantity": 1,
+        "partial": option.partial,
+        "price": _decimal(option.price),
+        "size": _decimal(option.size),
+        "stock_balance": _decimal(option.stock_balance),
+    }
+
+
+class ProductFastSerializer(serializers.BaseSerializer):
+    def to_representation(self, instance):
+        options = [_option(option) for option in instance.options.all()]
+        if not options:
+            return None
+        data = self.product_fields(instance)
+        data["options"] = options
+        request = self.context.get("request")
+        data["images"] = [
+            {"image": _file_url(image.image, request), "renditions": image_renditions(image.image, request)}
+            for image in instance.images.all()
+        ]
+        data.update(self.detail_fields(instance))
+        data["chosen_option"] = options[0]
+        return data
+
+    def product_fields(self, instance):
+        return {
+            "id": instance.id,
+            "min_price_options": _decimal(instance.min_price_options),
+            "greatest_discount": _integer(instance.greatest_discount),
+            "min_price": _decimal(instance.min_price),
+            "discount_by_subcategory": _integer(instance.discount_by_subcategory),
+            "name": instance.name,
+        }
+
+    def detail_fields(self, instance):
+        return {}
+
+
+class ProductDetailFastSerializer(ProductFastSerializer):
+    def product_fields(self, instance):
+        brand = instance.brand
+        return {
+            "id": instance.id,
+            "greatest_discount": _integer(instance.greatest_discount),
+            "discount_by_subcategory": _integer(instance.discount_by_subcategory),
+            "name": instance.name,
+            "brand": None if brand is None else {
+                "id": brand.id,
+                "name": brand.name,
+                "image": _file_url(brand.image, self.context.get("request")),
+                "renditions": image_renditions(brand.image, self.context.get("request")),
+            },
+        }
+
+    def detail_fields(self, instance):
+        return {
+            "description": instance.description,
+            "features": instance.features,
+            "composition": instance.composition,
+            "additives": instance.additives,
+            "analysis": instance.analysis,
+        }
 
 
 class AnimalSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = Animal
         fields = (
             "id",
             "name",
             "image",
+            "renditions",
         )
 
 
 class ArticleSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = Article
         fields = "__all__"
@@ -241,12 +363,15 @@ class InfoShopMainPageSerializer(serializers.ModelSerializer):
 
 
 class BannerSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = Banner
         fields = (
             "title",
             "color",
             "image",
+            "renditions",
         )
 
 
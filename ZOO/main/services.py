@@ -1,16 +1,21 @@
 import os
+from datetime import timedelta
 from dotenv import load_dotenv
 from decimal import *
 import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Notification, ProductOptions
 load_dotenv()
 
 my_chat_id = os.getenv('CHAT_ID')
 TOKEN = os.getenv('BOT_TOKEN')
-URL = 'https://api.telegram.org/bot'
 URLMETHOD = '/sendMessage'
 
 
-# @app.task(ignore_result=True)
 def send_order_bot(data):
     text_items = f""
     for item in data['items']:
@@ -25,55 +30,98 @@ def send_order_bot(data):
     text = f"📍Новый Заказ\n" \
            f"{data['customer'].get('customer_name')} {data['customer'].get('phone_number')}\n" \
            f"💴На сумму: {data.get('total_with_discount')},\n❗️скидка: {Decimal(data.get('total_no_discount')) - Decimal(data.get('total_with_discount'))}\n"
-    requests.post(url=URL + TOKEN + URLMETHOD,
-                  data={'chat_id': my_chat_id,
-                        'text': f'{text + text_items}',
-                        'parse_mode': 'markdown'}, json=True)
+    Notification.objects.create(text=text + text_items)
 
 
 def call_back_bot(data):
     text = f"📞Новая заявка на консультацию!!!\n" \
            f"{data['customer_name']}, {data['phone_number']}"
-    requests.post(url=URL + TOKEN + URLMETHOD,
-                  data={'chat_id': my_chat_id,
-                        'text': f'{text}',
-                        'parse_mode': 'markdown'}, json=True)
+    Notification.objects.create(text=text)
 
 
 def bot_comment(data):
-    requests.post(url=URL + TOKEN + URLMETHOD,
-                  data={'chat_id': my_chat_id,
-                        'text': f'💬Добавлен новый комментарий,\n'
-                                f'просмотреть можно в административной панеле сайта',
-                        'parse_mode': 'markdown'}, json=True)
-
-
-def basket_counter(items, discount_by_day):
-    getcontext().prec = 6
-    total_with_discount = Decimal('0')
-    total_no_discount = Decimal('0')
-    for item in items:
-        discounts = [item['max_discount'], item['chosen_option']['discount_by_option']]
-        discounts_list = [x for x in discounts if x is not None]
-        if discounts_list:
-            max_discount = max(discounts_list)
-            if item['chosen_option']['partial']:
-                item_quantity = item['chosen_option']['quantity'] / 1000
+    Notification.objects.create(text=f'💬Добавлен новый комментарий,\n'
+                                     f'просмотреть можно в административной панеле сайта')
+
+
+def send_telegram(text):
+    response = requests.post(url=f'{settings.TELEGRAM_API_URL}{TOKEN}{URLMETHOD}',
+                             data={'chat_id': my_chat_id,
+                                   'text': text,
+                                   'parse_mode': 'markdown'},
+                             timeout=settings.TELEGRAM_TIMEOUT)
+    response.raise_for_status()
+
+
+def claim_notifications(batch_size):
+    """
+    Забирает пачку уведомлений: короткая транзакция помечает их как
+    отправляемые и засчитывает попытку. Уведомления, оставшиеся в отправке
+    дольше NOTIFICATIONS_SENDING_TIMEOUT (упавший воркер), забираются снова.
+    """
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.NOTIFICATIONS_SENDING_TIMEOUT)
+    with transaction.atomic():
+        notifications = list(
+            Notification.objects.select_for_update(skip_locked=True).filter(
+                Q(status=Notification.STATUS_PENDING, next_attempt__lte=now)
+                | Q(status=Notification.STATUS_SENDING, date_attempt__lt=abandoned)
+            )[:batch_size]
+        )
+        for notification in notifications:
+            notification.status = Notification.STATUS_SENDING
+            notification.attempts += 1
+            notification.date_attempt = now
+        Notification.objects.bulk_update(notifications, ["status", "attempts", "date_attempt"])
+    return notifications
+
+
+def send_pending_notifications(batch_size=None):
+    """
+    Отправляет пачку уведомлений из очереди. Запросы к Telegram идут вне
+    транзакции. Неудачные попытки повторяются с экспоненциальной задержкой
+    до NOTIFICATIONS_MAX_ATTEMPTS раз.
+    Возвращает количество обработанных уведомлений.
+    """
+    notifications = claim_notifications(batch_size or settings.NOTIFICATIONS_BATCH_SIZE)
+    sending = Notification.objects.filter(status=Notification.STATUS_SENDING)
+    sent = []
+    for notification in notifications:
+        try:
+            send_telegram(notification.text)
+        except requests.RequestException as e:
+            if notification.attempts >= settings.NOTIFICATIONS_MAX_ATTEMPTS:
+                sending.filter(pk=notification.pk).update(
+                    status=Notification.STATUS_FAILED, last_error=str(e)
+                )
             else:
-                item_quantity = item['chosen_option']['quantity']
-            price_with_discount = (Decimal(item['chosen_option']['price']) * Decimal((100 - max_discount) / 100))
-            total_with_discount += price_with_discount.quantize(Decimal("1.00"), ROUND_HALF_UP) * item_quantity
+                delay = settings.NOTIFICATIONS_RETRY_DELAY * 2 ** (notification.attempts - 1)
+                sending.filter(pk=notification.pk).update(
+                    status=Notification.STATUS_PENDING,
+                    last_error=str(e),
+                    next_attempt=timezone.now() + timedelta(seconds=delay),
+                )
         else:
-            if item['chosen_option']['partial']:
-                item_quantity = item['chosen_option']['quantity'] / 1000
-            else:
-                item_quantity = item['chosen_option']['quantity']
-            total_no_discount += Decimal(item['chosen_option']['price']) * Decimal(item_quantity)
-    if len(discount_by_day) > 0:
-        for discount in discount_by_day[0]['options']:
-            if total_no_discount >= discount['min_price_for_discount']:
-                total_no_discount = (Decimal(total_no_discount) * Decimal((100 - discount['discount_amount']) / 100)) \
-                    .quantize(Decimal("1.00"), ROUND_HALF_UP)
-                break
-    final_sum = total_no_discount + total_with_discount
-    return final_sum
+            sent.append(notification.pk)
+    sending.filter(pk__in=sent).update(status=Notification.STATUS_SENT, date_sent=timezone.now())
+    return len(notifications)
+
+
+def decrement_stock(options, quantities):
+    """
+    Списывает остатки заблокированных фасовок одним UPDATE.
+    options - {артикул: ProductOptions}, quantities - {артикул: Decimal}
+    """
+    ProductOptions.objects.filter(pk__in=[option.pk for option in options.values()]).update(
+        stock_balance=F("stock_balance") - Case(
+            *[
+                When(pk=option.pk, then=Value(quantities[article_number]))
+                for article_number, option in options.items()
+            ],
+            default=Value(0),
+            output_field=DecimalField(max_digits=8, decimal_places=2),
+        )
+    )
+    ProductOptions.objects.filter(
+        pk__in=[option.pk for option in options.values()], stock_balance__lte=0
+    ).update(is_active=False)
@@ -0,0 +1,109 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .activity import touch_products
+from .cache import bump_version_on_commit
+from .images import has_renditions
+from .search import update_search_vector
+from .models import (
+    Animal,
+    Article,
+    Banner,
+    Brand,
+    Category,
+    Comments,
+    DiscountByDay,
+    DiscountByDayOptions,
+    DiscountByProductOption,
+    DiscountBySubCategory,
+    InfoShop,
+    InfoShopBlock,
+    InfoShopMainPage,
+    Product,
+    ProductImage,
+    ProductOptions,
+    RenditionTask,
+    SubCategory,
+    Units,
+)
+
+# Какие закешированные ресурсы API устаревают при изменении модели
+MODEL_RESOURCES = {
+    Product: ("products", "brands", "catalog_index", "suggest"),
+    ProductOptions: ("products",),
+    ProductImage: ("products",),
+    Units: ("products", "units"),
+    Brand: ("brands", "products", "suggest"),
+    Animal: ("animals", "categories"),
+    Category: ("categories",),
+    SubCategory: ("categories", "suggest"),
+    DiscountByProductOption: ("products",),
+    DiscountBySubCategory: ("products", "categories"),
+    DiscountByDay: ("discounts",),
+    DiscountByDayOptions: ("discounts",),
+    Article: ("articles",),
+    Comments: ("comments",),
+    InfoShop: ("shop_info",),
+    InfoShopBlock: ("shop_info",),
+    InfoShopMainPage: ("shop_info",),
+    Banner: ("shop_info",),
+}
+
+
+def invalidate_resources(sender, **kwargs):
+    bump_version_on_commit(*MODEL_RESOURCES[sender])
+
+
+def invalidate_products_m2m(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_version_on_commit("products", "brands")
+
+
+for model in MODEL_RESOURCES:
+    post_save.connect(invalidate_resources, sender=model, dispatch_uid=f"cache_{model.__name__}_save")
+    post_delete.connect(invalidate_resources, sender=model, dispatch_uid=f"cache_{model.__name__}_delete")
+
+for through in (Product.animal.through, Product.category.through, Product.subcategory.through):
+    m2m_changed.connect(invalidate_products_m2m, sender=through)
+
+
+def update_product_search(sender, instance, **kwargs):
+    update_search_vector((instance.pk,))
+
+
+def update_brand_search(sender, instance, **kwargs):
+    update_search_vector(instance.products.values_list("pk", flat=True))
+
+
+post_save.connect(update_product_search, sender=Product, dispatch_uid="search_product_save")
+post_save.connect(update_brand_search, sender=Brand, dispatch_uid="search_brand_save")
+
+
+def touch_image_product(sender, instance, **kwargs):
+    touch_products((instance.product_id,))
+
+
+def touch_option_product(sender, instance, **kwargs):
+    touch_products((instance.product_id,))
+
+
+def touch_units_products(sender, instance, **kwargs):
+    touch_products(instance.prods.values_list("product_id", flat=True))
+
+
+# Время обновления витрины - версия закешированного JSON товара
+post_save.connect(touch_image_product, sender=ProductImage, dispatch_uid="listing_image_save")
+post_delete.connect(touch_image_product, sender=ProductImage, dispatch_uid="listing_image_delete")
+# Сохранение фасовки пересчитывает товар в ProductOptions.save, удаление - здесь
+post_delete.connect(touch_option_product, sender=ProductOptions, dispatch_uid="listing_option_delete")
+post_save.connect(touch_units_products, sender=Units, dispatch_uid="listing_units_save")
+
+
+def enqueue_image_renditions(sender, instance, **kwargs):
+    # Новый файл получает новое имя, поэтому рендиций для него ещё нет.
+    # Рендиции создаёт воркер generate_renditions --watch.
+    if instance.image and not has_renditions(instance.image):
+        RenditionTask.enqueue(instance.image.name)
+
+
+for model in (ProductImage, Brand, Animal, Article, Banner):
+    post_save.connect(enqueue_image_renditions, sender=model, dispatch_uid=f"renditions_{model.__name__}")
@@ -0,0 +1,80 @@
+import threading
+from bisect import bisect_left
+
+from .cache import get_versions
+from .models import Brand, ProductListing, SubCategory
+
+# Меняются только при изменении названий товаров витрины, брендов и подкатегорий
+SUGGEST_RESOURCES = ("suggest",)
+
+
+def normalize(text):
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class PrefixIndex:
+    """
+    Отсортированный массив ключей для поиска по префиксу. Для каждого названия
+    хранится ключ на каждое слово (название с этого слова до конца), поэтому
+    "сухой" находит и "Корм сухой для кошек".
+    """
+
+    def __init__(self, items):
+        keys = []
+        for pk, name in items:
+            words = normalize(name).split()
+            for position in range(len(words)):
+                keys.append((" ".join(words[position:]), pk, name))
+        keys.sort()
+        self.keys = [key for key, _, _ in keys]
+        self.items = [(pk, name) for _, pk, name in keys]
+
+    def search(self, query, limit):
+        found = {}
+        for position in range(bisect_left(self.keys, query), len(self.keys)):
+            if len(found) == limit or not self.keys[position].startswith(query):
+                break
+            pk, name = self.items[position]
+            found.setdefault(pk, {"id": pk, "name": name})
+        return list(found.values())
+
+
+class SuggestIndex:
+    """Префиксные индексы названий товаров витрины, брендов и подкатегорий"""
+
+    def __init__(self, items_by_kind):
+        self.indexes = {kind: PrefixIndex(items) for kind, items in items_by_kind.items()}
+
+    @classmethod
+    def build(cls):
+        return cls(
+            {
+                "products": ProductListing.objects.values_list("product_id", "name"),
+                "brands": Brand.objects.values_list("id", "name"),
+                "subcategories": SubCategory.objects.values_list("id", "name"),
+            }
+        )
+
+    def search(self, query, limit):
+        query = normalize(query)
+        return {
+            kind: index.search(query, limit) if query else []
+            for kind, index in self.indexes.items()
+        }
+
+
+_index = None
+_index_versions = None
+_index_lock = threading.Lock()
+
+
+def get_suggest_index():
+    """Индекс процесса; пересобирается, когда меняется версия suggest в кеше"""
+    global _index, _index_versions
+    versions = get_versions(SUGGEST_RESOURCES)
+    if _index is None or _index_versions != versions:
+        with _index_lock:
+            if _index is None or _index_versions != versions:
+                _index = SuggestIndex.build()
+                _index_versions = versions
+    return _index
@@ -1,3 +1,483 @@
-from django.test import TestCase
+import json
+import unittest
+from collections import OrderedDict
+from unittest import mock
 
-# Create your tests here.
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .cache import get_versions
+from .listing import refresh_product_listing
+from .pricing import BasketTotals, price_baskets
+from .models import (
+    Animal,
+    Brand,
+    Category,
+    DiscountByDay,
+    DiscountByDayOptions,
+    DiscountByProductOption,
+    DiscountBySubCategory,
+    Order,
+    OrderItem,
+    Product,
+    ProductImage,
+    ProductListing,
+    ProductOptions,
+    SubCategory,
+    Units,
+)
+from .serializers import (
+    ProductDetailFastSerializer,
+    ProductDetailSerializer,
+    ProductFastSerializer,
+    ProductSerializer,
+)
+from .views import BrandViewSet, ProductViewSet
+
+LISTING_ANNOTATIONS = (
+    "discount_by_subcategory",
+    "min_price_options",
+    "first_option_discount",
+    "greatest_discount",
+    "min_price",
+)
+CATALOG_SIZE = 20000
+LARGE_TABLES = ("main_product", "main_productlisting")
+MAX_ROWS_REMOVED = CATALOG_SIZE // 20
+
+PRODUCT_FILTERS = (
+    {"animal": "{animal}"},
+    {"brand": "{brand}"},
+    {"brand": "{brand},{brand2}"},
+    {"category": "{category}"},
+    {"subcategory": "{subcategory}"},
+    {"subcategory": "{subcategory},{subcategory2}"},
+    {"animal": "{animal}", "category": "{category}"},
+    {"animal": "{animal}", "category": "{category}", "subcategory": "{subcategory}"},
+    {"animal": "{animal}", "brand": "{brand}"},
+    {"category": "{category}", "on_discount": "1"},
+    {"animal": "{animal}", "ordering": "-min_price"},
+    {"category": "{category}", "ordering": "popular"},
+    {"subcategory": "{subcategory}", "ordering": "-date_added"},
+)
+BRAND_FILTERS = (
+    {"animal": "{animal}"},
+    {"animal": "{animal}", "category": "{category}"},
+)
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "EXPLAIN планы только для Postgres")
+class CatalogQueryPlanTests(TestCase):
+    """
+    Фильтры каталога не должны приводить к Seq Scan и раздутым Nested Loop.
+    Планы строятся с enable_seqscan = off: на синтетическом каталоге Postgres
+    может честно выбрать Seq Scan, а Seq Scan при запрете значит, что для
+    фильтра нет подходящего индекса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        animals = Animal.objects.bulk_create(Animal(name=f"Животное {i}") for i in range(20))
+        categories = Category.objects.bulk_create(
+            Category(name=f"Категория {i}", animal=animals[i % len(animals)]) for i in range(100)
+        )
+        subcategories = SubCategory.objects.bulk_create(
+            SubCategory(name=f"Подкатегория {i}", category=categories[i % len(categories)])
+            for i in range(400)
+        )
+        brands = Brand.objects.bulk_create(Brand(name=f"Бренд {i}") for i in range(300))
+        products = []
+        for i in range(CATALOG_SIZE):
+            subcategory = subcategories[i % len(subcategories)]
+            category = categories[subcategory.category_id % len(categories)]
+            products.append(
+                Product(
+                    name=f"Товар {i}",
+                    brand=brands[i % len(brands)],
+                    popular=i % 3,
+                    animal_ids=[category.animal_id],
+                    category_ids=[category.id],
+                    subcategory_ids=[subcategory.id],
+                )
+            )
+        products = Product.objects.bulk_create(products, batch_size=2000)
+        ProductListing.objects.bulk_create(
+            (
+                ProductListing(
+                    product=product,
+                    name=product.name,
+                    brand_id=product.brand_id,
+                    popular=product.popular,
+                    date_added=product.date_added,
+                    min_price_options=10 + i % 500,
+                    greatest_discount=10 if i % 50 == 0 else None,
+                    min_price=10 + i % 500,
+                    animal_ids=product.animal_ids,
+                    category_ids=product.category_ids,
+                    subcategory_ids=product.subcategory_ids,
+                )
+                for i, product in enumerate(products)
+            ),
+            batch_size=2000,
+        )
+        with connection.cursor() as cursor:
+            for table in LARGE_TABLES:
+                cursor.execute(f"ANALYZE {table}")
+        cls.params = {
+            "animal": animals[3].id,
+            "brand": brands[7].id,
+            "brand2": brands[8].id,
+            "category": categories[13].id,
+            "subcategory": subcategories[113].id,
+            "subcategory2": subcategories[114].id,
+        }
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def build_queryset(self, viewset_class, params):
+        params = {key: value.format(**self.params) for key, value in params.items()}
+        view = viewset_class(action="list", format_kwarg=None, kwargs={})
+        view.request = Request(APIRequestFactory().get("/", params))
+        return params, view.filter_queryset(view.get_queryset())
+
+    def assert_plan_is_indexed(self, queryset, params, ordered=False):
+        """
+        Большие таблицы не читаются Seq Scan, а строки, отброшенные фильтром
+        после чтения (в том числе во внутреннем цикле Nested Loop), не
+        превышают MAX_ROWS_REMOVED. Запросу страницы (ordered) с ORDER BY ...
+        LIMIT разрешено идти по индексу сортировки, отбрасывая строки.
+        """
+        plan = json.loads(queryset.explain(format="json", analyze=True))[0]["Plan"]
+        for node in plan_nodes(plan):
+            with self.subTest(params=params, node=node["Node Type"]):
+                if node.get("Relation Name") in LARGE_TABLES:
+                    self.assertNotEqual(node["Node Type"], "Seq Scan")
+                    removed = node.get("Rows Removed by Filter", 0) * node["Actual Loops"]
+                    if not ordered:
+                        self.assertLessEqual(removed, MAX_ROWS_REMOVED)
+                if node["Node Type"] == "Nested Loop":
+                    self.assertLessEqual(node["Plan Rows"], CATALOG_SIZE)
+
+    def test_product_filters(self):
+        for params in PRODUCT_FILTERS:
+            params, queryset = self.build_queryset(ProductViewSet, params)
+            self.assert_plan_is_indexed(queryset[:10], params, ordered=True)
+            self.assert_plan_is_indexed(queryset.order_by().values("pk"), params)
+
+    def test_brand_filters(self):
+        for params in BRAND_FILTERS:
+            params, queryset = self.build_queryset(BrandViewSet, params)
+            self.assert_plan_is_indexed(queryset, params)
+
+
+# Тест очищает кеш: не трогаем общий Redis
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductFastSerializerTests(TestCase):
+    """Быстрые сериализаторы товара дают тот же JSON, что и эталонные"""
+
+    @classmethod
+    def setUpTestData(cls):
+        grams = Units.objects.create(unit_name="г")
+        pieces = Units.objects.create(unit_name="шт")
+        animal = Animal.objects.create(name="Кошки")
+        category = Category.objects.create(name="Корм", animal=animal)
+        subcategory = SubCategory.objects.create(name="Сухой", category=category)
+        DiscountBySubCategory.objects.create(subcategory=subcategory, discount_amount=10, is_active=True)
+        active = DiscountByProductOption.objects.create(title="Акция", discount_amount=15, is_active=True)
+        inactive = DiscountByProductOption.objects.create(title="Архив", discount_amount=5, is_active=False)
+        brand = Brand.objects.create(name="Acana", image="photos_brand/acana.jpg")
+        products = [
+            Product.objects.create(name="Корм с фото", brand=brand),
+            Product.objects.create(name="Корм без бренда"),
+            Product.objects.create(name="Корм на развес", brand=brand),
+        ]
+        products[0].subcategory.set((subcategory,))
+        ProductImage.objects.create(product=products[0], image="photos_products/one.jpg")
+        ProductImage.objects.create(product=products[0])
+        ProductOptions.objects.bulk_create(
+            (
+                ProductOptions(article_number="1", product=products[0], price=Decimal("10.5"),
+                               size=Decimal("400"), stock_balance=Decimal("3"), units=pieces,
+                               discount_by_product_option=active),
+                ProductOptions(article_number="2", product=products[0], price=Decimal("99.99"),
+                               size=Decimal("1000"), stock_balance=Decimal("1.25"), units=None,
+                               discount_by_product_option=inactive),
+                ProductOptions(article_number="3", product=products[1], price=Decimal("7"),
+                               size=Decimal("1"), stock_balance=Decimal("12"), units=pieces),
+                ProductOptions(article_number="4", product=products[2], price=Decimal("1234.56"),
+                               size=Decimal("1000"), stock_balance=Decimal("5500"), units=grams,
+                               partial=True),
+            )
+        )
+        refresh_product_listing()
+
+    def render(self, serializer_class, instance, many=False):
+        request = Request(APIRequestFactory().get("/api/products/"))
+        data = serializer_class(instance, many=many, context={"request": request}).data
+        return JSONRenderer().render(data)
+
+    def products(self):
+        view = ProductViewSet(action="retrieve", format_kwarg=None, kwargs={})
+        view.request = Request(APIRequestFactory().get("/api/products/"))
+        return list(view.get_queryset().order_by("id"))
+
+    def test_list_matches_reference(self):
+        products = self.products()
+        self.assertEqual(
+            self.render(ProductFastSerializer, products, many=True),
+            self.render(ProductSerializer, products, many=True),
+        )
+
+    def test_list_view_matches_reference(self):
+        """
+        Ответ ProductViewSet.list, склеенный из фрагментов encoded_products,
+        совпадает с эталоном побайтно - и при заполнении кеша фрагментов,
+        и при чтении из него (второй запрос другой страницей мимо кеша ответов)
+        """
+        cache.clear()
+        view = ProductViewSet.as_view({"get": "list"})
+        for params in ({"page_size": 10}, {"page_size": 20}):
+            with self.subTest(params=params):
+                response = view(APIRequestFactory().get("/api/products/", params))
+                response.render()
+                ids = [item["id"] for item in json.loads(response.content)["results"]]
+                products = {product.pk: product for product in self.products()}
+                expected = OrderedDict(response.data)
+                expected["results"] = ProductSerializer(
+                    [products[pk] for pk in ids],
+                    many=True,
+                    context={"request": Request(APIRequestFactory().get("/api/products/", params))},
+                ).data
+                self.assertEqual(len(ids), len(products))
+                self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_detail_matches_reference(self):
+        for product in self.products():
+            with self.subTest(product=product.name):
+                self.assertEqual(
+                    self.render(ProductDetailFastSerializer, product),
+                    self.render(ProductDetailSerializer, product),
+                )
+
+    def test_product_without_options(self):
+        product = self.products()[0]
+        ProductOptions.objects.filter(product=product).delete()
+        product = Product.objects.prefetch_related("options", "images").annotate(
+            **{field: F(f"listing__{field}") for field in LISTING_ANNOTATIONS}
+        ).get(pk=product.pk)
+        self.assertEqual(
+            self.render(ProductFastSerializer, [product], many=True),
+            self.render(ProductSerializer, [product], many=True),
+        )
+
+
+@mock.patch("main.views.Recommend")
+class OrderCreateTests(TestCase):
+    """Оформление заказа: число запросов не зависит от размера корзины"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", password="password")
+        units = Units.objects.create(unit_name="шт")
+        Units.objects.create(unit_name="г")
+        products = Product.objects.bulk_create(Product(name=f"Товар {i}") for i in range(5))
+        ProductOptions.objects.bulk_create(
+            ProductOptions(article_number=f"A{i}", product=product, price=Decimal("100"),
+                           size=Decimal("1"), stock_balance=Decimal("50"), units=units)
+            for i, product in enumerate(products)
+        )
+        refresh_product_listing()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order(self, lines):
+        return self.client.post(
+            "/api/order/",
+            {
+                "phone_number": "+375291234567",
+                "customer_name": "Иван Петров",
+                "orderInfo": {
+                    "productsInBasket": [
+                        {"id": product_id, "chosen_option": {"article_number": article, "quantity": quantity}}
+                        for product_id, article, quantity in lines
+                    ]
+                },
+            },
+            format="json",
+        )
+
+    def lines(self, count):
+        options = ProductOptions.objects.order_by("article_number")[:count]
+        return [(option.product_id, option.article_number, "2") for option in options]
+
+    def test_query_count_does_not_depend_on_basket_size(self, recommend):
+        with CaptureQueriesContext(connection) as one_line:
+            self.assertEqual(self.order(self.lines(1)).status_code, 201)
+        with CaptureQueriesContext(connection) as five_lines:
+            self.assertEqual(self.order(self.lines(5)).status_code, 201)
+        self.assertEqual(len(one_line), len(five_lines))
+        self.assertEqual(OrderItem.objects.count(), 6)
+        self.assertEqual(ProductOptions.objects.get(article_number="A0").stock_balance, 46)
+
+    def test_unknown_article_is_rejected(self, recommend):
+        response = self.order([*self.lines(1), (None, "нет такого", "1")])
+        self.assertEqual(response.status_code, 402)
+        self.assertEqual(response.json()[0]["chosen_option"]["article_number"], "нет такого")
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ProductOptions.objects.get(article_number="A0").stock_balance, 50)
+
+    def test_fractional_quantity_is_rejected(self, recommend):
+        response = self.order([(None, "A0", "1.5")])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class VersionBumpOnCommitTests(TestCase):
+    """Версии кеша меняются только после коммита транзакции, изменившей данные"""
+
+    def assert_bumped_on_commit(self, resources, change):
+        before = get_versions(resources)
+        with self.captureOnCommitCallbacks() as callbacks:
+            change()
+        self.assertEqual(get_versions(resources), before)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(all(new != old for new, old in zip(get_versions(resources), before)))
+
+    def test_model_save(self):
+        self.assert_bumped_on_commit(("brands", "products"), lambda: Brand.objects.create(name="Acana"))
+
+    def test_listing_refresh(self):
+        product = Product.objects.create(name="Корм")
+        ProductOptions.objects.bulk_create(
+            (ProductOptions(article_number="1", product=product, price=Decimal("10"), size=Decimal("1"),
+                            stock_balance=Decimal("1")),)
+        )
+        self.assert_bumped_on_commit(
+            ("products", "brands", "catalog_index", "suggest"),
+            lambda: refresh_product_listing((product.pk,)),
+        )
+
+
+class OptionDeleteTests(TestCase):
+    """Удаление фасовки пересчитывает активность и витрину её товара"""
+
+    def test_delete_last_option(self):
+        product = Product.objects.create(name="Корм")
+        ProductOptions.objects.bulk_create(
+            (ProductOptions(article_number="1", product=product, price=Decimal("10"), size=Decimal("1"),
+                            stock_balance=Decimal("1")),)
+        )
+        refresh_product_listing((product.pk,))
+        self.assertTrue(ProductListing.objects.filter(product=product).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductOptions.objects.get(article_number="1").delete()
+        self.assertFalse(ProductListing.objects.filter(product=product).exists())
+        product.refresh_from_db()
+        self.assertFalse(product.is_active)
+
+
+class PricingTests(TestCase):
+    """Расчёт корзины по серверным ценам и действующим скидкам"""
+
+    WEDNESDAY, THURSDAY = 2, 3
+
+    @classmethod
+    def setUpTestData(cls):
+        units = Units.objects.create(unit_name="шт")
+        category = Category.objects.create(name="Корм", animal=Animal.objects.create(name="Кошки"))
+        on_sale = SubCategory.objects.create(name="Сухой", category=category)
+        archived = SubCategory.objects.create(name="Влажный", category=category)
+        DiscountBySubCategory.objects.create(subcategory=on_sale, discount_amount=20, is_active=True)
+        DiscountBySubCategory.objects.create(subcategory=archived, discount_amount=50, is_active=False)
+        discount_15 = DiscountByProductOption.objects.create(title="Акция", discount_amount=15, is_active=True)
+        discount_10 = DiscountByProductOption.objects.create(title="Акция", discount_amount=10, is_active=True)
+        inactive = DiscountByProductOption.objects.create(title="Архив", discount_amount=30, is_active=False)
+        day = DiscountByDay.objects.create(title="Среда", is_active=True, week_days=[cls.WEDNESDAY])
+        DiscountByDayOptions.objects.create(discount_by_day=day, min_price_for_discount=50, discount_amount=5)
+        DiscountByDayOptions.objects.create(discount_by_day=day, min_price_for_discount=100, discount_amount=10)
+        day_off = DiscountByDay.objects.create(title="Архив", is_active=False, week_days=[cls.WEDNESDAY])
+        DiscountByDayOptions.objects.create(discount_by_day=day_off, min_price_for_discount=0, discount_amount=50)
+        plain = Product.objects.create(name="Корм")
+        sale_product = Product.objects.create(name="Корм со скидкой")
+        sale_product.subcategory.set((on_sale,))
+        archived_product = Product.objects.create(name="Корм из архива")
+        archived_product.subcategory.set((archived,))
+        cls.options = {
+            option.article_number: option
+            for option in ProductOptions.objects.bulk_create(
+                ProductOptions(
+                    article_number=article_number, product=product, price=Decimal(price), size=Decimal("1"),
+                    units=units, partial=partial, discount_by_product_option=discount,
+                    stock_balance=Decimal("100000"),
+                )
+                for article_number, product, price, partial, discount in (
+                    ("A", plain, "12.35", False, discount_15),
+                    ("B", plain, "24.90", True, None),
+                    ("C", sale_product, "9.99", False, discount_10),
+                    ("D", plain, "33.33", False, inactive),
+                    ("E", archived_product, "40.00", False, None),
+                    ("F", plain, "25.00", False, None),
+                )
+            )
+        }
+
+    def price(self, lines, weekday):
+        return price_baskets([[(self.options[article], quantity) for article, quantity in lines]], weekday)[0]
+
+    def test_partial_quantity_in_grams(self):
+        # 750 г по 24.90 за кг
+        self.assertEqual(self.price([("B", 750)], self.THURSDAY), BasketTotals(Decimal("18.68"), Decimal("18.68")))
+
+    def test_day_discount_threshold(self):
+        self.assertEqual(self.price([("F", 1)], self.WEDNESDAY).total_with_discount, Decimal("25.00"))
+        self.assertEqual(self.price([("F", 2)], self.WEDNESDAY).total_with_discount, Decimal("47.50"))
+        self.assertEqual(self.price([("F", 3)], self.WEDNESDAY).total_with_discount, Decimal("71.25"))
+        self.assertEqual(self.price([("F", 4)], self.WEDNESDAY).total_with_discount, Decimal("90.00"))
+        # Скидка дня не применяется к товарам с другими скидками
+        self.assertEqual(self.price([("A", 10)], self.WEDNESDAY).total_with_discount, Decimal("105.00"))
+
+    def test_inactive_and_other_day_discounts_are_ignored(self):
+        self.assertEqual(self.price([("D", 1)], self.THURSDAY), BasketTotals(Decimal("33.33"), Decimal("33.33")))
+        self.assertEqual(self.price([("E", 1)], self.THURSDAY), BasketTotals(Decimal("40.00"), Decimal("40.00")))
+        self.assertEqual(self.price([("F", 4)], self.THURSDAY).total_with_discount, Decimal("100.00"))
+
+    def test_greatest_discount_wins(self):
+        # 9.99 со скидкой подкатегории 20% вместо скидки фасовки 10%
+        self.assertEqual(self.price([("C", 1)], self.THURSDAY).total_with_discount, Decimal("7.99"))
+
+    def test_matches_basket_counter(self):
+        """Итоги совпадают с прежним services.basket_counter (с округлением до копеек)"""
+        mixed = [("A", 3), ("B", 750), ("C", 4)]
+        no_discounts = [("B", 750), ("D", 1)]
+        self.assertEqual(self.price(mixed, self.WEDNESDAY), BasketTotals(Decimal("95.69"), Decimal("82.14")))
+        self.assertEqual(self.price(no_discounts, self.WEDNESDAY).total_with_discount, Decimal("49.40"))
+        self.assertEqual(self.price(no_discounts, self.THURSDAY).total_with_discount, Decimal("52.01"))
+
+    def test_snapshot_is_shared_between_baskets(self):
+        baskets = [[(self.options["A"], 3)], [(self.options["F"], 2)], [(self.options["C"], 1)]]
+        with self.assertNumQueries(3):
+            totals = price_baskets(baskets, self.WEDNESDAY)
+        self.assertEqual(
+            [basket.total_with_discount for basket in totals],
+            [Decimal("31.50"), Decimal("47.50"), Decimal("7.99")],
+        )
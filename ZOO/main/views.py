@@ -1,18 +1,32 @@
 import datetime
+import json
 from collections import OrderedDict
-from decimal import Decimal
-from django.db.models import Case, F, Min, OuterRef, Prefetch, Q, Subquery, When
-from django.db.models.functions import Greatest
+from decimal import Decimal, InvalidOperation
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Q, prefetch_related_objects
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
-from rest_framework.filters import OrderingFilter, SearchFilter
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import (
+    Cursor,
+    CursorPagination,
+    PageNumberPagination,
+    _reverse_ordering,
+)
 from rest_framework.permissions import BasePermission, IsAuthenticated
 from rest_framework.response import Response
 
+from .activity import update_products_activity
+from .cache import get_versions, versioned_cache_page, versioned_condition
+from .catalog_index import get_catalog_index
+from .facets import catalog_facets
 from .models import (
     Animal,
     Article,
@@ -23,13 +37,23 @@ from .models import (
     Consultation,
     Customer,
     DiscountByDay,
+    DiscountByDayOptions,
+    DiscountBySubCategory,
     InfoShop,
+    InfoShopBlock,
+    InfoShopMainPage,
     Order,
+    OrderItem,
     Product,
     ProductOptions,
     SubCategory,
 )
-from .recommendations import Recommend
+from .paginators import EstimatedCountPaginator
+from .pricing import price_baskets
+from .recommendations import SUGGESTIONS_CACHE_KEY, Recommend
+from .renderers import EncodedFragments, encode_json
+from .search import ProductSearchFilter
+from .suggest import get_suggest_index
 from .serializers import (
     AnimalSerializer,
     ArticleSerializer,
@@ -41,22 +65,27 @@ from .serializers import (
     CustomerSerializer,
     DiscountByDaySerializer,
     InfoShopSerializer,
-    OrderItemSerializer,
     OrderSerializer,
-    ProductDetailSerializer,
+    ProductDetailFastSerializer,
+    ProductFastSerializer,
     ProductOptionsSerializer,
-    ProductSerializer,
 )
-from .services import bot_comment, call_back_bot, send_order_bot
+from .services import bot_comment, call_back_bot, decrement_stock, send_order_bot
+
+# Предел PositiveIntegerField для OrderItem.quantity
+MAX_ORDER_QUANTITY = 2147483647
 
 
 class Pagination(PageNumberPagination):
     page_size_query_param = "page_size"
     page_size = 10
+    # С API_ESTIMATED_COUNT число товаров на больших выборках - оценка Postgres
+    django_paginator_class = EstimatedCountPaginator if settings.API_ESTIMATED_COUNT else Paginator
 
     def paginate_queryset(self, queryset, request, view=None):
-        self.get_count_qs = queryset.count()
-        return super(Pagination, self).paginate_queryset(queryset, request, view=view)
+        page = super(Pagination, self).paginate_queryset(queryset, request, view=view)
+        self.get_count_qs = self.page.paginator.count
+        return page
 
     def get_paginated_response(self, data):
         return Response(
@@ -76,6 +105,124 @@ class Pagination(PageNumberPagination):
         )
 
 
+LISTING_ORDERING_FIELDS = {
+    "name": "listing__name",
+    "popular": "listing__popular",
+    "date_added": "listing__date_added",
+    "min_price": "listing__min_price",
+}
+
+
+def listing_ordering(ordering):
+    """Сортировка по колонкам витрины, по которым идут и фильтры каталога"""
+    return [
+        ("-" if order.startswith("-") else "")
+        + LISTING_ORDERING_FIELDS.get(order.lstrip("-"), order.lstrip("-"))
+        for order in ordering
+    ]
+
+
+class ListingOrderingFilter(OrderingFilter):
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if ordering:
+            return queryset.order_by(*listing_ordering(ordering))
+        return queryset
+
+
+class ProductCursorPagination(CursorPagination):
+    """Keyset-пагинация: позиция курсора - (значение поля сортировки, id)"""
+
+    page_size_query_param = "page_size"
+    page_size = 10
+    ordering = ("name",)
+    count_ignored_params = ("cursor", "ordering", "page_size", "pagination")
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)[:1]
+        tiebreaker = "-id" if ordering[0].startswith("-") else "id"
+        return ordering + (tiebreaker,)
+
+    def get_total_count(self, queryset, request):
+        signature = sorted(
+            (key, request.query_params.getlist(key))
+            for key in request.query_params
+            if key not in self.count_ignored_params
+        )
+        version = get_versions(("products",))[0]
+        key = f"PRODUCTS_COUNT:{version}:" + md5(repr(signature).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PRODUCTS_COUNT_TTL)
+        return count
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        self.total_count = self.get_total_count(queryset, request)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        ordering = listing_ordering(ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after_position(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def _after_position(self, ordering, position):
+        try:
+            value, pk = json.loads(position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        field, tiebreaker = (order.lstrip("-") for order in ordering)
+        lookup = "lt" if ordering[0].startswith("-") else "gt"
+        return Q(**{f"{field}__{lookup}": value}) | Q(
+            **{field: value, f"{tiebreaker}__{lookup}": pk}
+        )
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([str(getattr(instance, ordering[0].lstrip("-"))), instance.pk])
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("products_on_page", len(data)),
+                    ("total_products", self.total_count),
+                    ("max_products_on_page", self.page_size),
+                    ("results", data),
+                ]
+            )
+        )
+
+
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     # queryset = (
     #     Product.objects.filter(is_active=True)
@@ -137,116 +284,143 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     #     )
     # )
 
-    serializer_class = ProductSerializer
+    serializer_class = ProductFastSerializer
     pagination_class = Pagination
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
-    search_fields = ("name",)
+    filter_backends = (DjangoFilterBackend, ListingOrderingFilter, ProductSearchFilter)
     ordering_fields = ("name", "popular", "date_added", "min_price")
     ordering = ("name",)
 
-    @method_decorator(cache_page(60, key_prefix="PRODUCTS_LIST"))
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if self.request.query_params.get("pagination") == "cursor":
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @method_decorator(versioned_cache_page(("products",), key_prefix="PRODUCTS_LIST"))
     def list(self, request, *args, **kwargs):
-        response = super().list(request, args, kwargs)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        response = self.get_paginated_response(self.encoded_products(page))
         if len(response.data["results"]) == 0:
             response.status_code = 400
         return response
 
+    def encoded_products(self, products):
+        """
+        Закодированный JSON товаров страницы из кеша фрагментов. Ключ включает
+        время обновления витрины товара, поэтому меняется вместе с ним.
+        """
+        host = md5(self.request.build_absolute_uri("/").encode()).hexdigest()
+        keys = [
+            f"PRODUCT_JSON:{host}:{product.pk}:{product.listing_updated.timestamp()}"
+            for product in products
+        ]
+        fragments = cache.get_many(keys)
+        missing = [(key, product) for key, product in zip(keys, products) if key not in fragments]
+        if missing:
+            missing_products = [product for _, product in missing]
+            prefetch_related_objects(missing_products, *self.product_prefetches())
+            data = self.get_serializer(missing_products, many=True).data
+            encoded = {key: encode_json(item) for (key, _), item in zip(missing, data)}
+            cache.set_many(encoded, settings.CACHE_VERSIONED_TTL)
+            fragments.update(encoded)
+        return EncodedFragments(fragments[key] for key in keys)
+
+    def product_prefetches(self):
+        return (
+            Prefetch(
+                "options",
+                queryset=ProductOptions.objects.filter(is_active=True)
+                .select_related("units", "discount_by_product_option")
+                .defer("date_created", "date_updated"),
+            ),
+            "images",
+        )
+
     def get_queryset(self):
-        queryset = (
-            Product.objects.filter(is_active=True)
-            .prefetch_related(
-                Prefetch(
-                    "options",
-                    queryset=ProductOptions.objects.filter(is_active=True)
-                    .select_related("units", "discount_by_product_option")
-                    .defer("date_created", "date_updated"),
-                )
-            ).filter(options__is_active=True)
-            .prefetch_related(
-                Prefetch(
-                    "subcategory",
-                    queryset=SubCategory.objects.select_related("discount_subcategory"),
-                ),
-                "images",
-            )
-            .annotate(
-                discount_by_subcategory=F(
-                    "subcategory__discount_subcategory__discount_amount"
-                )
-            )
-            .annotate(
-                min_price_options=Min(
-                    "options__price",
-                )
-            )
-            .annotate(min_price_options=Subquery(
-                ProductOptions.objects.filter(
-                    product=OuterRef("pk"))[:1]
-                .values("price")
-            )
-            )
-            .annotate(
-                first_option_discount=Subquery(
-                    ProductOptions.objects.filter(
-                        product=OuterRef("pk"),
-                        is_active=True,
-                        discount_by_product_option__is_active=True,
-                    )[:1]
-                    .annotate(min_discount=F("discount_by_product_option__discount_amount"))
-                    .values("min_discount")
-                )
-            )
-            .annotate(
-                greatest_discount=Greatest(
-                    "discount_by_subcategory", "first_option_discount"
-                )
-            )
-            .annotate(
-                min_price=Case(
-                    When(greatest_discount=None, then=F("min_price_options")),
-                    When(
-                        greatest_discount__gte=0,
-                        then=F("min_price_options") * (100 - F("greatest_discount")) / 100,
-                        ),
-                    )
-                )
-            )
+        queryset = Product.objects.filter(listing__isnull=False)
+        # Для списка фасовки и фото загружаются только для товаров, которых нет в кеше фрагментов
+        if self.action != "list":
+            queryset = queryset.prefetch_related(*self.product_prefetches())
+        queryset = queryset.annotate(
+            discount_by_subcategory=F("listing__discount_by_subcategory"),
+            min_price_options=F("listing__min_price_options"),
+            first_option_discount=F("listing__first_option_discount"),
+            greatest_discount=F("listing__greatest_discount"),
+            min_price=F("listing__min_price"),
+            listing_updated=F("listing__date_updated"),
+        )
         animal = self.request.query_params.get("animal")
         if animal:
-            queryset = queryset.filter(animal_ids__overlap=[animal])
+            queryset = queryset.filter(listing__animal_ids__overlap=[animal])
         brands = self.request.query_params.getlist("brand")
         if brands:
             brand_list = brands[0].split(",")
-            queryset = queryset.filter(brand_id__in=brand_list)
+            queryset = queryset.filter(listing__brand_id__in=brand_list)
         category = self.request.query_params.get("category")
         if category:
-            queryset = queryset.filter(category_ids__overlap=[category])
+            queryset = queryset.filter(listing__category_ids__overlap=[category])
         subcategory = self.request.query_params.getlist("subcategory")
         if subcategory:
             subcategory_list = subcategory[0].split(",")
-            queryset = queryset.filter(subcategory_ids__overlap=subcategory_list)
+            queryset = queryset.filter(listing__subcategory_ids__overlap=subcategory_list)
         on_discount = self.request.query_params.get("on_discount")
         if on_discount:
-            queryset = queryset.filter(greatest_discount__gt=0)
+            queryset = queryset.filter(listing__greatest_discount__gt=0)
         return queryset
 
+    def filter_queryset(self, queryset):
+        if self.action == "list" and settings.CATALOG_INDEX_ENABLED:
+            selection = get_catalog_index().select(self.request.query_params, self.ordering, queryset)
+            if selection is not None:
+                return selection
+        return super().filter_queryset(queryset)
+
     def get_object(self):
-        self.serializer_class = ProductDetailSerializer
+        self.serializer_class = ProductDetailFastSerializer
         return super(ProductViewSet, self).get_object()
 
+    @action(methods=["GET"], detail=False)
+    @method_decorator(versioned_cache_page(("products",), key_prefix="PRODUCTS_FACETS"))
+    def facets(self, request):
+        """Счётчики фильтров боковой панели для тех же параметров, что и список"""
+        return Response(catalog_facets(self.filter_queryset(self.get_queryset())))
+
+    @action(methods=["GET"], detail=False)
+    def suggest(self, request):
+        """Подсказки поиска из индекса в памяти процесса, без запросов к БД"""
+        query = request.query_params.get("search", "")
+        return Response(get_suggest_index().search(query, settings.SUGGEST_LIMIT))
+
     @action(methods=["GET"], detail=True)
     def accompanying_goods(self, request, pk=None):
+        key = SUGGESTIONS_CACHE_KEY.format(pk)
+        version = get_versions(("products",))[0]
+        cached = cache.get(key)
+        if cached is not None and cached["version"] == version:
+            return Response(cached["data"])
         r = Recommend()
         product_ids = r.suggest_products_for(pk)
-        queryset = self.queryset.filter(id__in=product_ids)
-        serializer = self.get_serializer(queryset, many=True)
+        products = sorted(
+            self.get_queryset().filter(id__in=product_ids),
+            key=lambda product: product_ids.index(product.id),
+        )
+        serializer = self.get_serializer(products, many=True)
+        cache.set(
+            key,
+            {"version": version, "data": serializer.data},
+            settings.CACHE_VERSIONED_TTL,
+        )
         return Response(serializer.data)
 
 
 class BrandViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = BrandSerializer
 
-    @method_decorator(cache_page(60, key_prefix="BRANDS_LIST"))
+    @method_decorator(versioned_condition(("brands",), models=(Brand, ProductOptions)))
+    @method_decorator(versioned_cache_page(("brands",), key_prefix="BRANDS_LIST"))
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
         return response
@@ -256,9 +430,10 @@ class BrandViewSet(viewsets.ReadOnlyModelViewSet):
         animal = self.request.query_params.get("animal")
         category = self.request.query_params.get("category")
         if animal:
-            qs = qs.filter(products__animal_ids__overlap=[animal]).distinct()
+            products = Product.objects.filter(brand=OuterRef("pk"), animal_ids__overlap=[animal])
             if category:
-                qs = qs.filter(products__category_ids__overlap=[category]).distinct()
+                products = products.filter(category_ids__overlap=[category])
+            qs = qs.filter(Exists(products))
         return qs
 
 
@@ -266,6 +441,10 @@ class AnimalViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Animal.objects.all()
     serializer_class = AnimalSerializer
 
+    @method_decorator(versioned_condition(("animals",), models=(Animal,)))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = (
@@ -284,7 +463,10 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_fields = ("animal",)
 
-    @method_decorator(cache_page(60, key_prefix="CATEGORY_LIST"))
+    @method_decorator(
+        versioned_condition(("categories",), models=(Category, SubCategory, DiscountBySubCategory))
+    )
+    @method_decorator(versioned_cache_page(("categories",), key_prefix="CATEGORY_LIST"))
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
         return response
@@ -301,7 +483,7 @@ class ArticleViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_fields = ("animals",)
 
-    @method_decorator(cache_page(60, key_prefix="ARTICLE_LIST"))
+    @method_decorator(versioned_cache_page(("articles",), key_prefix="ARTICLE_LIST"))
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
         return response
@@ -324,7 +506,7 @@ class CommentsView(
     permission_classes = (MyPerms,)
     serializer_class = CommentsListSerializer
 
-    @method_decorator(cache_page(60*2, key_prefix="COMMENTS_LIST"))
+    @method_decorator(versioned_cache_page(("comments",), key_prefix="COMMENTS_LIST"))
     def list(self, request, *args, **kwargs):
         comments = Comments.objects.filter(published=True)
         serializer = CommentsListSerializer(comments, many=True)
@@ -355,7 +537,12 @@ class InfoShopView(mixins.ListModelMixin, viewsets.GenericViewSet):
     )
     serializer_class = InfoShopSerializer
 
-    @method_decorator(cache_page(60*2, key_prefix="SHOP_INFO"))
+    @method_decorator(
+        versioned_condition(
+            ("shop_info",), models=(InfoShop, InfoShopMainPage, InfoShopBlock, Banner)
+        )
+    )
+    @method_decorator(versioned_cache_page(("shop_info",), key_prefix="SHOP_INFO"))
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
         serializer = self.get_serializer(queryset.first())
@@ -379,85 +566,83 @@ class OrderViewSet(
             "phone_number": request.data["phone_number"],
             "customer_name": request.data["customer_name"],
         }
-        order_items_list = []
-        articles_numbers = []
-        not_sellable = []
-        for item in items_basket:
-            articles_numbers.append(item["chosen_option"]["article_number"])
-            order_items_list.append(
+        quantities = {}
+        try:
+            lines = [
+                (item["chosen_option"]["article_number"], Decimal(item["chosen_option"]["quantity"]))
+                for item in items_basket
+            ]
+        except (InvalidOperation, TypeError):
+            return Response("Wrong Items", status=400)
+        # Количество - целое число штук, для развесных фасовок - граммов
+        if any(
+            not quantity.is_finite()
+            or quantity <= 0
+            or quantity != quantity.to_integral_value()
+            or quantity > MAX_ORDER_QUANTITY
+            for _, quantity in lines
+        ):
+            return Response("Wrong Items", status=400)
+        for article_number, quantity in lines:
+            quantities[article_number] = quantities.get(article_number, 0) + quantity
+        serializer_customer = CustomerSerializer(
+            Customer.objects.filter(phone_number=customer["phone_number"]).first(), data=customer
+        )
+        if not serializer_customer.is_valid():
+            return Response("Wrong Customer", status=400)
+        with transaction.atomic():
+            options = {
+                option.article_number: option
+                for option in ProductOptions.objects.select_for_update()
+                .filter(article_number__in=quantities)
+                .order_by("pk")
+            }
+            not_sellable = []
+            for item in items_basket:
+                article_number = item["chosen_option"]["article_number"]
+                option = options.get(article_number)
+                if option is None or option.stock_balance < quantities[article_number]:
+                    not_sellable.append(item)
+            if not_sellable:
+                return Response(not_sellable, status=402)
+            order_items_list = [
                 {
                     "article_number": item["chosen_option"]["article_number"],
                     "quantity": item["chosen_option"]["quantity"],
-                    "stock_balance": item["chosen_option"]["stock_balance"],
-                    "price": item["chosen_option"]["price"],
+                    "stock_balance": options[item["chosen_option"]["article_number"]].stock_balance,
+                    "price": options[item["chosen_option"]["article_number"]].price,
                 }
+                for item in items_basket
+            ]
+            # Позиции проверены до первой записи и без запросов: ответы с
+            # ошибкой выше не оставляют в транзакции частично созданный заказ
+            totals = price_baskets(
+                [[(options[article_number], quantity) for article_number, quantity in quantities.items()]]
+            )[0]
+            instance = serializer_customer.save()
+            order_obj = Order.objects.create(
+                customer_id=instance.id,
+                total_sum=totals.total_with_discount,
             )
-            if (ProductOptions.objects.get(article_number=item["chosen_option"]["article_number"]).stock_balance
-                    < Decimal(item["chosen_option"]["quantity"])):
-                not_sellable.append(item)
-        if not_sellable:
-            return Response(not_sellable, status=402)
-        try:
-            obj_customer = Customer.objects.get(phone_number=customer["phone_number"])
-            serializer_customer = CustomerSerializer(obj_customer, data=customer)
-            if serializer_customer.is_valid(raise_exception=True):
-                serializer_customer.save()
-                order_obj = Order.objects.create(
-                    customer_id=obj_customer.id,
-                    total_sum=request.data["orderInfo"]["basketCountWithDiscount"],
-                )
-            else:
-                return Response("Wrong Customer", status=400)
-        except:
-            serializer_customer = CustomerSerializer(data=customer)
-            if serializer_customer.is_valid():
-                instance = serializer_customer.save()
-                order_obj = Order.objects.create(
-                    customer_id=instance.id,
-                    total_sum=request.data["orderInfo"]["basketCountWithDiscount"],
-                )
-            else:
-                return Response("Wrong Customer", status=400)
-        # order_items_list = []
-        # articles_numbers = []
-        # for item in items_basket:
-        #     articles_numbers.append(item["chosen_option"]["article_number"])
-        #     order_items_list.append(
-        #         {
-        #             "article_number": item["chosen_option"]["article_number"],
-        #             "quantity": item["chosen_option"]["quantity"],
-        #             "stock_balance": item["chosen_option"]["stock_balance"],
-        #             "price": item["chosen_option"]["price"],
-        #         }
-        #     )
-        # TODO: for updating stock_balance in ProductOption
-
-        po_objects = ProductOptions.objects.filter(article_number__in=articles_numbers)
-        # one_more_list = []
-        for item in order_items_list:
-            obj_to_update = po_objects.get(article_number=item["article_number"])
-            obj_to_update.stock_balance = Decimal(item["stock_balance"]) - Decimal(item["quantity"])
-            obj_to_update.save()
-            # one_more_list.append(obj_to_update)
-        # updating = ProductOptions.objects.bulk_update(one_more_list, ["stock_balance"])
-        items_order_serializer = OrderItemSerializer(data=order_items_list, many=True)
-        if items_order_serializer.is_valid():
-            items_order_serializer.save(order_id=order_obj.id)
-            r = Recommend()
-            r.products_bought(items_basket)
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order_obj, article_number=options[article_number], quantity=int(quantity))
+                    for article_number, quantity in lines
+                ]
+            )
+            decrement_stock(options, quantities)
+            update_products_activity(option.product_id for option in options.values())
             send_order_bot(
                 {
-                    "total_with_discount": request.data["orderInfo"][
-                        "basketCountWithDiscount"
-                    ],
-                    "total_no_discount": request.data["orderInfo"]["basketCount"],
+                    "total_with_discount": totals.total_with_discount,
+                    "total_no_discount": totals.total_no_discount,
                     "items": order_items_list,
                     "customer": customer,
                 }
             )
-            return Response(status=201)
-        else:
-            return Response("Wrong Items", status=400)
+        r = Recommend()
+        r.products_bought(items_basket)
+        return Response(status=201)
 
     @action(methods=["POST"], detail=False, url_path="call_back", name="call_back")
     def call_back(self, request):
@@ -487,6 +672,12 @@ class OrderViewSet(
 class DiscountByDayViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = DiscountByDaySerializer
 
+    @method_decorator(
+        versioned_condition(("discounts",), models=(DiscountByDay, DiscountByDayOptions), daily=True)
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def get_queryset(self):
         queryset = (
             DiscountByDay.objects.filter(is_active=True)